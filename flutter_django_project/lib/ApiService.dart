@@ -266,6 +266,11 @@ class ApiService {
       if (response.statusCode == 201) {
         print('✅ Upload successful!');
         return {'success': true, 'data': jsonDecode(responseBody)};
+      } else if (response.statusCode == 202) {
+        // Processing continues on the server; poll until it finishes
+        final data = jsonDecode(responseBody);
+        print('⏳ Upload accepted, processing document ${data['id']}...');
+        return await waitForDocument(data['id']);
       } else {
         try {
           final errorData = jsonDecode(responseBody);
@@ -302,6 +307,73 @@ class ApiService {
       return {'success': false, 'error': 'Upload failed: $e'};
     }
   }
+  // Poll a document's ingestion status until it completes or fails
+  static Future<Map<String, dynamic>> waitForDocument(int documentId,
+      {Duration maxWait = const Duration(minutes: 10),
+      Duration interval = const Duration(seconds: 2)}) async {
+    final deadline = DateTime.now().add(maxWait);
+    try {
+      while (DateTime.now().isBefore(deadline)) {
+        final token = await getToken();
+        if (token == null) {
+          return {
+            'success': false,
+            'error': 'Not authenticated. Please login again.'
+          };
+        }
+
+        // Short polls: a held-open request would tie up a server worker
+        final response = await http.get(
+          Uri.parse('${baseUrl}documents/$documentId/status/'),
+          headers: {'Authorization': 'Bearer $token'},
+        ).timeout(Duration(seconds: 10));
+
+        if (response.statusCode == 401 || response.statusCode == 403) {
+          final refreshResult = await _refreshToken();
+          if (refreshResult['success'] != true) {
+            return {
+              'success': false,
+              'error': 'Authentication failed. Please login again.',
+              'shouldLogout': true
+            };
+          }
+          continue;
+        }
+        if (response.statusCode != 200) {
+          return {
+            'success': false,
+            'error': 'Failed to fetch upload status: ${response.statusCode}'
+          };
+        }
+
+        final data = jsonDecode(response.body);
+        print('⏳ Document $documentId: ${data['status']} (${data['progress']}%)');
+        if (data['status'] == 'completed') {
+          print('✅ Upload successful!');
+          return {'success': true, 'data': data};
+        }
+        if (data['status'] == 'failed') {
+          return {
+            'success': false,
+            'error': data['error'] ?? 'Failed to process PDF'
+          };
+        }
+        await Future.delayed(interval);
+      }
+      return {
+        'success': false,
+        'error': 'Document is still processing. Check your documents later.'
+      };
+    } on TimeoutException {
+      return {
+        'success': false,
+        'error': 'Status check timeout: Server took too long to respond'
+      };
+    } catch (e) {
+      return {'success': false, 'error': 'Error checking upload status: $e'};
+    }
+  }
+
   // Ask question (with longer timeout and token refresh retry)
   static Future<Map<String, dynamic>> askQuestion(String question,
       {bool isRetry = false}) async {
@@ -389,7 +461,19 @@ class ApiService {
     }
   }
 
-  //
+  // Documents and history are paginated with ?limit= / ?cursor=, newest first
+  static const int pageSize = 50;
+
+  static Future<http.Response> _getPage(String path, String token,
+      {int limit = pageSize, String? cursor}) {
+    final params = {'limit': '$limit', if (cursor != null) 'cursor': cursor};
+    return http.get(
+      Uri.parse('$baseUrl$path').replace(queryParameters: params),
+      headers: {'Authorization': 'Bearer $token'},
+    ).timeout(Duration(seconds: 10));
+  }
+
+  // Get all documents, one page at a time
   static Future<Map<String, dynamic>> getDocuments() async {
     try {
       final token = await getToken();
@@ -400,26 +484,30 @@ class ApiService {
         };
       }
 
-      final response = await http.get(
-        Uri.parse('${baseUrl}documents/list/'),
-        headers: {'Authorization': 'Bearer $token'},
-      ).timeout(Duration(seconds: 10));
+      final documents = <dynamic>[];
+      String? cursor;
+      do {
+        final response =
+            await _getPage('documents/list/', token, cursor: cursor);
+        if (response.statusCode != 200) {
+          return {
+            'success': false,
+            'error': 'Failed to fetch documents: ${response.statusCode}'
+          };
+        }
+        final page = jsonDecode(response.body);
+        documents.addAll(page['results']);
+        cursor = page['next_cursor'];
+      } while (cursor != null);
 
-      if (response.statusCode == 200) {
-        return {'success': true, 'data': jsonDecode(response.body)};
-      } else {
-        return {
-          'success': false,
-          'error': 'Failed to fetch documents: ${response.statusCode}'
-        };
-      }
+      return {'success': true, 'data': documents};
     } catch (e) {
       return {'success': false, 'error': 'Error fetching documents: $e'};
     }
   }
 
-  // Get query history
-  static Future<Map<String, dynamic>> getQueryHistory() async {
+  // Get one page of query history; pass next_cursor back for the next page
+  static Future<Map<String, dynamic>> getQueryHistory({String? cursor}) async {
     try {
       final token = await getToken();
       if (token == null) {
@@ -428,13 +516,15 @@ class ApiService {
           'error': 'Not authenticated. Please login again.'
         };
       }
-      final response = await http.get(
-        Uri.parse('${baseUrl}history/'),
-        headers: {'Authorization': 'Bearer $token'},
-      ).timeout(Duration(seconds: 10));
+      final response = await _getPage('history/', token, cursor: cursor);
 
       if (response.statusCode == 200) {
-        return {'success': true, 'data': jsonDecode(response.body)};
+        final page = jsonDecode(response.body);
+        return {
+          'success': true,
+          'data': page['results'],
+          'next_cursor': page['next_cursor'],
+        };
       } else {
         return {
           'success': false,
@@ -11,8 +11,8 @@ class StudentAdmin(admin.ModelAdmin):
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'file', 'uploaded_at', 'processed']
-    list_filter = ['processed', 'uploaded_at']
+    list_display = ['id', 'user', 'file', 'uploaded_at', 'processed', 'status', 'progress']
+    list_filter = ['processed', 'status', 'uploaded_at']
     search_fields = ['user__username', 'file']
 
 @admin.register(DocumentChunk)
@@ -0,0 +1,247 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from . import metrics
+
+
+class AdmissionRejected(Exception):
+    """Raised instead of queueing a request the limiter has no room for."""
+
+    def __init__(self, name, retry_after, reason):
+        self.retry_after = retry_after
+        super().__init__(f"{name} is busy ({reason}), retry in {int(retry_after)}s.")
+
+
+class _Ticket:
+    def __init__(self, user_id, notify):
+        self.user_id = user_id
+        self.notify = notify
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class Slot:
+    """A granted place in the limiter; release it exactly once."""
+
+    def __init__(self, limiter, user_id):
+        self.limiter = limiter
+        self.user_id = user_id
+        self.acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.limiter._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def wrap(self, iterable):
+        """Hold the slot while a streaming response is consumed."""
+        return _SlotIterator(self, iterable)
+
+
+class _SlotIterator:
+    # StreamingHttpResponse calls close() when the response ends, even if
+    # the client went away before the first chunk
+    def __init__(self, slot, iterable):
+        self.slot = slot
+        self.iterable = iterable
+
+    def __iter__(self):
+        try:
+            yield from self.iterable
+        finally:
+            self.slot.release()
+
+    def close(self):
+        close = getattr(self.iterable, 'close', None)
+        if close:
+            close()
+        self.slot.release()
+
+
+class AdmissionLimiter:
+    """
+    Caps concurrent calls to a slow dependency. Up to `max_concurrent`
+    callers run at once; up to `max_queue` more wait at most `max_wait`
+    seconds. Waiters are admitted round-robin across users, and one user
+    may have at most `per_user` calls running or queued. Anything beyond
+    that is rejected immediately with a Retry-After estimate.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, max_wait, per_user):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.per_user = per_user
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # Smoothed time a slot is held, for Retry-After estimates
+        self.hold_seconds = 1.0
+        self._active_by_user = {}
+        # user id -> deque of waiting tickets, in round-robin order
+        self._waiting = OrderedDict()
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    def _outstanding(self, user_id):
+        return self._active_by_user.get(user_id, 0) + len(self._waiting.get(user_id, ()))
+
+    def retry_after(self):
+        backlog = (self._queued + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(backlog * self.hold_seconds))
+
+    def _reject(self, reason):
+        self.rejected += 1
+        return AdmissionRejected(self.name, self.retry_after(), reason)
+
+    def _admit(self, user_id, waited):
+        self.active += 1
+        self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def _try_enter(self, user_id, notify):
+        """Grant a slot now, or queue a ticket. Returns (slot, ticket)."""
+        with self._lock:
+            if self._outstanding(user_id) >= self.per_user:
+                raise self._reject("too many requests for this user")
+            if self.active < self.max_concurrent and not self._queued:
+                self._admit(user_id, 0.0)
+                return Slot(self, user_id), None
+            if self._queued >= self.max_queue:
+                raise self._reject("queue full")
+            ticket = _Ticket(user_id, notify)
+            self._waiting.setdefault(user_id, deque()).append(ticket)
+            self._queued += 1
+            return None, ticket
+
+    def _grant_waiters(self):
+        # Caller holds the lock. Take the first user in rotation, serve
+        # their oldest ticket and move them to the back.
+        while self.active < self.max_concurrent and self._waiting:
+            user_id, tickets = next(iter(self._waiting.items()))
+            ticket = tickets.popleft()
+            self._queued -= 1
+            if tickets:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            self._admit(user_id, time.monotonic() - ticket.enqueued_at)
+            ticket.granted = True
+            ticket.notify()
+
+    def _abandon(self, ticket, timed_out=True):
+        """Give up on a queued ticket; returns True if it was granted meanwhile."""
+        with self._lock:
+            if ticket.granted:
+                return True
+            tickets = self._waiting.get(ticket.user_id)
+            tickets.remove(ticket)
+            if not tickets:
+                del self._waiting[ticket.user_id]
+            self._queued -= 1
+            if timed_out:
+                self.timed_out += 1
+                self.rejected += 1
+            return False
+
+    def _release(self, slot):
+        held = time.monotonic() - slot.acquired_at
+        with self._lock:
+            self.active -= 1
+            remaining = self._active_by_user[slot.user_id] - 1
+            if remaining:
+                self._active_by_user[slot.user_id] = remaining
+            else:
+                del self._active_by_user[slot.user_id]
+            self.hold_seconds = 0.8 * self.hold_seconds + 0.2 * held
+            self._grant_waiters()
+
+    def acquire(self, user):
+        """Block for a slot; raises AdmissionRejected. Use as a context manager."""
+        event = threading.Event()
+        slot, ticket = self._try_enter(user.pk, event.set)
+        if slot is not None:
+            return slot
+        if event.wait(self.max_wait) or self._abandon(ticket):
+            return Slot(self, user.pk)
+        raise AdmissionRejected(self.name, self.retry_after(), "timed out in queue")
+
+    async def acquire_async(self, user):
+        """Await a slot without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        slot, ticket = self._try_enter(user.pk, notify)
+        if slot is not None:
+            return slot
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+            return Slot(self, user.pk)
+        except asyncio.TimeoutError:
+            if self._abandon(ticket):
+                return Slot(self, user.pk)
+            raise AdmissionRejected(self.name, self.retry_after(), "timed out in queue")
+        except asyncio.CancelledError:
+            # The request went away while queued; a slot granted in the
+            # meantime must go back to the next waiter
+            if self._abandon(ticket, timed_out=False):
+                Slot(self, user.pk).release()
+            raise
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'active': self.active,
+                'max_concurrent': self.max_concurrent,
+                'queue_depth': self._queued,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'mean_wait_seconds': round(self.wait_seconds_total / self.admitted, 3) if self.admitted else 0,
+                'max_wait_seconds': round(self.wait_seconds_max, 3),
+            }
+
+
+llm_limiter = AdmissionLimiter(
+    'LLM service',
+    max_concurrent=getattr(settings, 'RAG_LLM_MAX_CONCURRENT', 8),
+    max_queue=getattr(settings, 'RAG_LLM_MAX_QUEUE', 32),
+    max_wait=getattr(settings, 'RAG_LLM_QUEUE_TIMEOUT', 10),
+    per_user=getattr(settings, 'RAG_LLM_PER_USER', 2),
+)
+
+
+def _collect_metrics():
+    snapshot = llm_limiter.snapshot()
+    return [
+        ('rag_llm_active', 'gauge', "LLM calls in progress.", snapshot['active']),
+        ('rag_llm_queue_depth', 'gauge', "LLM calls waiting for a slot.", snapshot['queue_depth']),
+        ('rag_llm_admitted_total', 'counter', "LLM calls admitted.", snapshot['admitted']),
+        ('rag_llm_rejected_total', 'counter', "LLM calls rejected by admission control.", snapshot['rejected']),
+        ('rag_llm_max_wait_seconds', 'gauge', "Longest wait for an LLM slot.", snapshot['max_wait_seconds']),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
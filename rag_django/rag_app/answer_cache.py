@@ -0,0 +1,76 @@
+import hashlib
+import re
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _cache():
+    return caches[settings.RAG_ANSWER_CACHE_ALIAS]
+
+
+def normalize_question(question):
+    """Case- and whitespace-insensitive form used as the exact-match key."""
+    return _WHITESPACE.sub(" ", question).strip().lower().rstrip("?.! ")
+
+
+def _answer_key(user, index_version, normalized):
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    return f"rag:answer:{user.pk}:{index_version}:{digest}"
+
+
+def _neighbours_key(user, index_version):
+    return f"rag:answer-neighbours:{user.pk}:{index_version}"
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype='float32')
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def get_answer(user, index_version, question):
+    """Exact-match lookup. The index version in the key means any upload or
+    delete for the user makes earlier answers unreachable."""
+    if not settings.RAG_ANSWER_CACHE_ENABLED or index_version is None:
+        return None
+    return _cache().get(_answer_key(user, index_version, normalize_question(question)))
+
+
+def get_similar_answer(user, index_version, question_vector):
+    """
+    Near-duplicate lookup: return the cached answer whose question embedding
+    has the highest cosine similarity to this one, if it clears the
+    configured threshold.
+    """
+    threshold = settings.RAG_ANSWER_CACHE_SIMILARITY
+    if not settings.RAG_ANSWER_CACHE_ENABLED or index_version is None or threshold <= 0:
+        return None
+    neighbours = _cache().get(_neighbours_key(user, index_version)) or []
+    if not neighbours:
+        return None
+    query = _unit(question_vector)
+    matrix = np.asarray([vector for _, vector in neighbours], dtype='float32')
+    scores = matrix @ query
+    best = int(np.argmax(scores))
+    if scores[best] < threshold:
+        return None
+    return _cache().get(_answer_key(user, index_version, neighbours[best][0]))
+
+
+def store_answer(user, index_version, question, answer, question_vector=None):
+    if not settings.RAG_ANSWER_CACHE_ENABLED or index_version is None:
+        return
+    cache = _cache()
+    normalized = normalize_question(question)
+    cache.set(_answer_key(user, index_version, normalized), answer, settings.RAG_ANSWER_CACHE_TTL)
+    if question_vector is None or settings.RAG_ANSWER_CACHE_SIMILARITY <= 0:
+        return
+    # Keep the most recent questions per user for near-duplicate matching
+    key = _neighbours_key(user, index_version)
+    neighbours = [n for n in cache.get(key) or [] if n[0] != normalized]
+    neighbours.append((normalized, _unit(question_vector).tolist()))
+    cache.set(key, neighbours[-settings.RAG_ANSWER_CACHE_NEIGHBOURS:], settings.RAG_ANSWER_CACHE_TTL)
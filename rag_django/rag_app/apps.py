@@ -1,4 +1,44 @@
+import logging
+import os
+import sys
+
 from django.apps import AppConfig
-class TasksConfig(AppConfig):
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# Programs that serve requests; background work is not started in other
+# manage.py commands, scripts or shells that set up Django
+_SERVER_PROGRAMS = {'gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'uwsgi', 'waitress-serve'}
+
+
+def _serving():
+    argv = getattr(sys, 'argv', None) or ['']
+    program = os.path.basename(argv[0])
+    if program == 'manage.py':
+        return argv[1:2] == ['runserver']
+    if program == '__main__.py':
+        # python -m uvicorn ...
+        program = os.path.basename(os.path.dirname(argv[0]))
+    return program in _SERVER_PROGRAMS
+
+
+class RagAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_app'
+
+    def ready(self):
+        # Optionally load the embedding model before the first request arrives
+        if getattr(settings, 'RAG_EMBEDDING_WARMUP', False):
+            from .embeddings import warm_up
+            try:
+                warm_up()
+                logger.info("Embedding model warmed up")
+            except Exception:
+                logger.exception("Embedding warm-up failed")
+
+        # Pick up documents left pending by a restart, then keep polling
+        if _serving():
+            from .ingestion import start_drainer
+            start_drainer()
@@ -0,0 +1,171 @@
+"""
+Async-native versions of the RAG endpoints, for deployments served over
+ASGI (e.g. `uvicorn rag_django.asgi:application`). Waiting on Gemini
+does not tie up a thread, so one process can hold many in-flight
+questions. Embedding, FAISS search and ingestion are CPU-bound and run
+on a bounded thread pool; short DB queries use sync_to_async.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from rest_framework import exceptions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import admission, answer_cache, health, ingestion, metrics
+from .admission import AdmissionRejected
+from .health import CircuitOpenError
+from .models import Document, QueryHistory
+from .serializers import DocumentSerializer
+from .views import (
+    counted_llm_call, overloaded_response, prepare_llm_call, question_errors, retrieve_context, validate_upload,
+)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.RAG_ASYNC_CPU_WORKERS,
+                    thread_name_prefix='rag-cpu',
+                )
+    return _executor
+
+
+def _close_connections_after(func, *args):
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(func, *args):
+    """Run CPU-bound or blocking work on the bounded pool and await it."""
+    loop = asyncio.get_running_loop()
+    # Carry the request's context over, so metric spans reach Server-Timing
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(context.run, _close_connections_after, func, *args)
+    )
+
+
+async def authenticate(request):
+    """JWT authentication for plain async views; returns the user or None."""
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def _error(message, status):
+    return JsonResponse({"error": message}, status=status)
+
+
+def _has_processed_documents(user):
+    return Document.objects.filter(user=user, processed=True).exists()
+
+
+async def process_user_question(user, user_question):
+    """Async counterpart of views.process_user_question, built from the same steps."""
+    with question_errors():
+        answer, docs, version, question_vector = await run_blocking(retrieve_context, user, user_question)
+        if answer is not None:
+            return answer
+
+        with counted_llm_call():
+            chain, inputs = prepare_llm_call(docs, user_question)
+            with metrics.span('llm_wait'):
+                slot = await admission.llm_limiter.acquire_async(user)
+            with slot, metrics.span('llm'):
+                response = await health.llm_breaker.acall(chain.acall, inputs, return_only_outputs=True)
+
+        answer = response["output_text"]
+        await run_blocking(answer_cache.store_answer, user, version, user_question, answer, question_vector)
+        return answer
+
+
+async def ask_question(request):
+    if request.method != 'POST':
+        return _error("Method not allowed.", 405)
+    user = await authenticate(request)
+    if user is None:
+        return _error("Authentication credentials were not provided or are invalid.", 401)
+
+    try:
+        data = json.loads(request.body or b'{}') if request.content_type == 'application/json' else request.POST
+    except ValueError:
+        return _error("Invalid JSON body.", 400)
+    if not isinstance(data, dict):
+        return _error("Expected a JSON object.", 400)
+    question = data.get('question', '')
+    if not question:
+        return _error("No question provided.", 400)
+
+    if not await sync_to_async(_has_processed_documents)(user):
+        return _error("Please process PDF documents first before asking questions.", 400)
+
+    try:
+        answer = await process_user_question(user, question)
+        await sync_to_async(QueryHistory.objects.create)(user=user, question=question, answer=answer)
+        return JsonResponse({"question": question, "answer": answer}, status=200)
+    except (CircuitOpenError, AdmissionRejected) as e:
+        return overloaded_response(e, JsonResponse)
+    except Exception as e:
+        logger.exception("Error answering question")
+        return _error(str(e), 500)
+
+
+def _save_upload(user, file):
+    document = Document(user=user, file=file)
+    document.save()
+    logger.info("Document saved: %s", document.file.name)
+    ingestion.enqueue(document)
+    return document
+
+
+async def upload_document(request):
+    if request.method != 'POST':
+        return _error("Method not allowed.", 405)
+    user = await authenticate(request)
+    if user is None:
+        return _error("Authentication credentials were not provided or are invalid.", 401)
+
+    try:
+        # Parsing the multipart body and writing the file touch the disk
+        files = await run_blocking(lambda: request.FILES)
+        error = validate_upload(files.get('file'))
+        if error:
+            return _error(error, 400)
+
+        document = await run_blocking(_save_upload, user, files['file'])
+        if document.status == Document.STATUS_FAILED:
+            return _error(document.error, 500)
+
+        data = dict(DocumentSerializer(document).data)
+        data['job_id'] = document.id
+        return JsonResponse(data, status=201 if document.status == Document.STATUS_COMPLETED else 202)
+    except Exception:
+        logger.exception("Unhandled exception in upload_document")
+        return _error("Internal server error", 500)
+
+
+# JWT-authenticated API views; Django 3.2's csrf_exempt decorator would
+# wrap these coroutines in a sync function, so set the flag directly
+ask_question.csrf_exempt = True
+upload_document.csrf_exempt = True
@@ -0,0 +1,337 @@
+"""
+Offline, reproducible benchmark of the RAG pipeline. Synthetic PDFs are
+generated from a seed, embeddings come from a hashing stand-in (or a
+small local model) and the LLM is a deterministic fake, so runs need no
+network and are comparable between commits. See `manage.py rag_benchmark`.
+
+The fakes are passed into the pipeline explicitly; nothing is patched.
+The run creates and deletes a user, uploads and an index shard in the
+configured database and storage, so it refuses to run outside a test
+database unless told otherwise.
+"""
+import hashlib
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.db import close_old_connections, connection
+from django.db.backends.base.creation import TEST_DATABASE_PREFIX
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from . import admission, embeddings, ingestion, metrics, vector_store, views
+from .admission import AdmissionRejected
+from .models import Document
+
+WORDS = (
+    "algorithm database network student course lecture exam semester module "
+    "theory practice design analysis system memory process thread compiler "
+    "matrix vector graph tree queue stack integral derivative probability "
+    "statistics physics chemistry biology economics history literature "
+    "assignment project report laboratory experiment result method sample "
+    "model training evaluation accuracy error function variable constant"
+).split()
+
+
+def synthetic_text(rng, num_words):
+    """Sentences of random vocabulary words, with the odd course code."""
+    words = []
+    for i in range(num_words):
+        if i % 97 == 0:
+            words.append(f"CS-{rng.randint(100, 499)}")
+        else:
+            words.append(rng.choice(WORDS))
+        if i % 12 == 11:
+            words[-1] += "."
+    return " ".join(words)
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path, pages, words_per_page, rng):
+    """Write a plain-text PDF with one Helvetica text block per page."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for _ in range(pages):
+        text = synthetic_text(rng, words_per_page)
+        lines = re.findall(r".{1,90}(?:\s|$)", text)
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(
+            f"({_pdf_escape(line.strip())}) '" for line in lines
+        ) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+class HashingEmbeddings:
+    """
+    Deterministic bag-of-words stand-in for the embedding model: each word
+    is hashed into one of `dim` buckets. Texts sharing words get similar
+    vectors, so retrieval still behaves sensibly.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype='float32')
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that answers instantly (or after a fixed delay) with a
+    canned reply, streamed word by word as message chunks like Gemini's.
+    """
+
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "rag-benchmark-fake-chat"
+
+    def _reply(self, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        prompt_length = sum(len(message.content) for message in messages)
+        return f"Benchmark answer for a {prompt_length}-character prompt."
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for word in re.findall(r"\S+\s*", self._reply(messages)):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+
+
+class Recorder:
+    """Thread-safe collection of per-stage latencies."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, elapsed):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(elapsed)
+
+    @contextmanager
+    def time(self, stage):
+        """
+        Time the block as `stage`, and record the pipeline's own spans
+        (metrics.span) run inside it under their stage names.
+        """
+        start = time.perf_counter()
+        try:
+            with metrics.collect_timings() as timings:
+                yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+            for span_stage, elapsed in timings:
+                self.add(span_stage, elapsed)
+
+    def total(self, stage):
+        return sum(self.samples.get(stage, ()))
+
+    def summary(self):
+        report = {}
+        for stage, values in self.samples.items():
+            ms = np.asarray(values) * 1000
+            report[stage] = {
+                'count': len(values),
+                'mean_ms': round(float(ms.mean()), 2),
+                'p50_ms': round(float(np.percentile(ms, 50)), 2),
+                'p95_ms': round(float(np.percentile(ms, 95)), 2),
+                'p99_ms': round(float(np.percentile(ms, 99)), 2),
+                'max_ms': round(float(ms.max()), 2),
+            }
+        return report
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its finished children."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(peak, children) / 1024, 1)
+
+
+def _load_embedding_model(model_name):
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name, model_kwargs={'device': 'cpu'})
+
+
+def is_test_database():
+    """True when the default connection points at a test (or in-memory) database."""
+    name = str(connection.settings_dict['NAME'])
+    if name == connection.settings_dict.get('TEST', {}).get('NAME'):
+        return True
+    if getattr(connection, 'is_in_memory_db', lambda: False)():
+        return True
+    return os.path.basename(name).startswith(TEST_DATABASE_PREFIX)
+
+
+class DatabaseNotAllowed(Exception):
+    pass
+
+
+def run_benchmark(documents=3, pages=20, words_per_page=400, questions=50, concurrency=1,
+                  llm_latency=0.0, seed=0, embedding_model=None, stream=False,
+                  allow_database=False, log=print):
+    """
+    Ingest `documents` synthetic PDFs and ask `questions` questions against
+    them as a throwaway user, then delete the user, files and index shard.
+    With stream=True questions go through the SSE path. Stage latencies
+    come from the spans of each single ingestion or answer. Returns a
+    report of per-stage latency percentiles, throughput and peak RSS.
+    Raises DatabaseNotAllowed outside a test database unless allow_database.
+    """
+    if not (allow_database or is_test_database()):
+        raise DatabaseNotAllowed(
+            f"Refusing to benchmark against {connection.settings_dict['NAME']!r}, which is not a "
+            f"test database; it would add and remove a user, documents and an index there."
+        )
+    rng = random.Random(seed)
+    recorder = Recorder()
+    workdir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    model = _load_embedding_model(embedding_model) if embedding_model else HashingEmbeddings()
+    fake_llm = FakeChatModel(latency=llm_latency)
+    # All questions come from one user, so size the limiter to the workload
+    limiter = admission.AdmissionLimiter(
+        'LLM service', max_concurrent=concurrency, max_queue=questions, max_wait=60, per_user=concurrency
+    )
+    user = User.objects.create(username=f"rag-benchmark-{uuid.uuid4().hex[:12]}")
+    created = []
+    rejected = 0
+
+    try:
+        with embeddings.use_embeddings(model):
+            # --- ingestion workload ---
+            pdf_paths = []
+            for i in range(documents):
+                path = os.path.join(workdir, f"synthetic_{i}.pdf")
+                write_synthetic_pdf(path, pages, words_per_page, rng)
+                pdf_paths.append(path)
+
+            for path in pdf_paths:
+                with open(path, 'rb') as f:
+                    # Saved as already claimed, so no ingestion worker picks it up
+                    document = Document(user=user, file=File(f, name=os.path.basename(path)),
+                                        status=Document.STATUS_PROCESSING)
+                    document.save()
+                created.append(document)
+                with recorder.time('ingest_document'):
+                    ingestion.ingest_document(document)
+                if document.status != Document.STATUS_COMPLETED:
+                    raise RuntimeError(f"Ingestion failed: {document.error}")
+            log(f"Ingested {documents} documents of {pages} pages")
+
+            # --- question workload ---
+            # Numbered so that no question is answered from the answer cache
+            question_texts = [
+                " ".join(rng.choice(WORDS) for _ in range(6)) + f" ({i})?" for i in range(questions)
+            ]
+
+            def ask(question):
+                nonlocal rejected
+                try:
+                    with recorder.time('answer'):
+                        if stream:
+                            events = "".join(views.stream_user_question(user, question, llm=fake_llm,
+                                                                        limiter=limiter))
+                            if "event: error" in events:
+                                raise RuntimeError(f"Streaming failed: {events}")
+                        else:
+                            views.process_user_question(user, question, llm=fake_llm, limiter=limiter)
+                except AdmissionRejected:
+                    rejected += 1
+                finally:
+                    if concurrency > 1:
+                        close_old_connections()
+
+            start = time.perf_counter()
+            if concurrency > 1:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    list(pool.map(ask, question_texts))
+            else:
+                for question in question_texts:
+                    ask(question)
+            question_seconds = time.perf_counter() - start
+            log(f"Asked {questions} questions with concurrency {concurrency}")
+    finally:
+        vector_store.remove_index(user)
+        for document in created:
+            document.file.delete(save=False)
+        user.delete()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ingest_seconds = recorder.total('ingest_document')
+    return {
+        'config': {
+            'documents': documents, 'pages': pages, 'words_per_page': words_per_page,
+            'questions': questions, 'concurrency': concurrency, 'llm_latency': llm_latency,
+            'seed': seed, 'embedding_model': embedding_model or 'hashing', 'stream': stream,
+        },
+        'stages': recorder.summary(),
+        'throughput': {
+            'documents_per_second': round(documents / ingest_seconds, 2) if ingest_seconds else None,
+            'pages_per_second': round(documents * pages / ingest_seconds, 2) if ingest_seconds else None,
+            'questions_per_second': round(questions / question_seconds, 2) if question_seconds else None,
+        },
+        'rejected_questions': rejected,
+        'llm_admission': limiter.snapshot(),
+        'peak_rss_mb': peak_rss_mb(),
+    }
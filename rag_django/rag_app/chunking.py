@@ -0,0 +1,236 @@
+"""
+Structure-aware chunking sized in embedding-model tokens. Extracted text
+is split into headings and sentences; sentences are packed into chunks
+of at most RAG_CHUNK_TOKENS tokens, so no chunk is silently truncated by
+the model. Headings always start a new chunk and page breaks are
+preferred cut points. Each chunk records the pages it spans and its
+character offsets in the extracted text.
+"""
+import re
+from collections import namedtuple
+
+from django.conf import settings
+
+PAGE_BREAK = "\n\n--- Page Break ---\n\n"
+
+# Chunk and its position: pages are 1-based and inclusive, offsets index
+# the text passed to split_document()
+Chunk = namedtuple('Chunk', 'text page_start page_end char_start char_end')
+
+_Unit = namedtuple('_Unit', 'start end page heading tokens')
+
+# Long words count as several tokens, as WordPiece splits them; this also
+# keeps text extracted without spaces from being counted as a few words
+_SIMPLE_TOKEN_RE = re.compile(r"\w{1,6}|[^\w\s]")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n\s*\n")
+_LINE_RE = re.compile(r"[^\n]+")
+_WORD_RE = re.compile(r"\S+")
+_NUMBERED_HEADING_RE = re.compile(
+    r"^(?:(?:chapter|section|part|appendix)\s+[\w.]+|\d+(?:\.\d+)*\.?\s+[A-Z])", re.IGNORECASE
+)
+
+# Special tokens ([CLS], [SEP]) the model adds around every input
+_SPECIAL_TOKENS = 2
+
+
+class SimpleTokenCounter:
+    """
+    Regex approximation of a WordPiece token count. It errs towards
+    overcounting, so chunks stay within the model window.
+    """
+
+    max_tokens = None
+
+    def count(self, texts):
+        return [len(_SIMPLE_TOKEN_RE.findall(text)) for text in texts]
+
+
+class ModelTokenCounter:
+    """Counts tokens with the embedding model's own tokenizer."""
+
+    def __init__(self, tokenizer, max_tokens=None):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+
+    def count(self, texts):
+        if not texts:
+            return []
+        encoded = self.tokenizer(list(texts), add_special_tokens=False, verbose=False)
+        return [len(ids) for ids in encoded['input_ids']]
+
+
+def get_token_counter():
+    """
+    Token counter for the configured embedding model. Models without an
+    accessible tokenizer (test doubles, the benchmark's hashing stand-in)
+    fall back to SimpleTokenCounter.
+    """
+    from .embeddings import get_embeddings
+
+    client = getattr(get_embeddings(), 'client', None)
+    tokenizer = getattr(client, 'tokenizer', None)
+    if tokenizer is None:
+        return SimpleTokenCounter()
+    max_seq_length = getattr(client, 'max_seq_length', None)
+    return ModelTokenCounter(tokenizer, max_seq_length - _SPECIAL_TOKENS if max_seq_length else None)
+
+
+def is_heading(line):
+    """Short numbered ("2.1 Methods", "Chapter 3") or all-caps lines."""
+    line = line.strip()
+    if not line or len(line) > 80 or len(line.split()) > 10 or line[-1] in '.,;':
+        return False
+    if _NUMBERED_HEADING_RE.match(line):
+        return True
+    return line.isupper() and sum(c.isalpha() for c in line) >= 3
+
+
+def split_sentences(text):
+    """Sentences of a passage, with surrounding whitespace trimmed."""
+    return [sentence.strip() for sentence in _SENTENCE_END_RE.split(text) if sentence.strip()]
+
+
+def _segments(text):
+    """
+    (start, end, page, heading) spans of the text, in order: heading lines
+    and the sentences between them, with surrounding whitespace trimmed.
+    """
+    offset = 0
+    for page, page_text in enumerate(text.split(PAGE_BREAK), start=1):
+        block_start = None
+        for line in _LINE_RE.finditer(page_text):
+            if is_heading(line.group()):
+                if block_start is not None:
+                    yield from _sentences(page_text, block_start, line.start(), offset, page)
+                    block_start = None
+                yield _trim(page_text, line.start(), line.end(), offset) + (page, True)
+            elif block_start is None:
+                block_start = line.start()
+        if block_start is not None:
+            yield from _sentences(page_text, block_start, len(page_text), offset, page)
+        offset += len(page_text) + len(PAGE_BREAK)
+
+
+def _sentences(page_text, start, end, offset, page):
+    position = start
+    for boundary in _SENTENCE_END_RE.finditer(page_text, start, end):
+        if page_text[position:boundary.start()].strip():
+            yield _trim(page_text, position, boundary.start(), offset) + (page, False)
+        position = boundary.end()
+    if page_text[position:end].strip():
+        yield _trim(page_text, position, end, offset) + (page, False)
+
+
+def _trim(page_text, start, end, offset):
+    segment = page_text[start:end]
+    start += len(segment) - len(segment.lstrip())
+    end -= len(segment) - len(segment.rstrip())
+    return offset + start, offset + end
+
+
+def _split_word(text, start, end, counter, max_tokens, tokens):
+    """
+    Cut a single word over max_tokens (a URL, text extracted without
+    spaces) at character offsets into spans that fit.
+    """
+    while start < end:
+        size = max(1, (end - start) * max_tokens // tokens)
+        piece_tokens = counter.count([text[start:start + size]])[0]
+        while size > 1 and piece_tokens > max_tokens:
+            size = size * 3 // 4
+            piece_tokens = counter.count([text[start:start + size]])[0]
+        yield start, start + size, piece_tokens
+        start += size
+
+
+def _split_long(text, unit, counter, max_tokens):
+    """Split a sentence longer than max_tokens at word boundaries, or inside over-long words."""
+    words = list(_WORD_RE.finditer(text, unit.start, unit.end))
+    counts = counter.count([word.group() for word in words])
+    spans = []
+    for word, count in zip(words, counts):
+        if count > max_tokens:
+            spans.extend(_split_word(text, word.start(), word.end(), counter, max_tokens, count))
+        else:
+            spans.append((word.start(), word.end(), count))
+
+    pieces, start, end, tokens = [], None, None, 0
+    for span_start, span_end, count in spans:
+        if start is not None and tokens + count > max_tokens:
+            pieces.append(unit._replace(start=start, end=end, tokens=tokens))
+            start, tokens = None, 0
+        if start is None:
+            start = span_start
+        end = span_end
+        tokens += count
+    if start is not None:
+        pieces.append(unit._replace(start=start, end=end, tokens=tokens))
+    return pieces
+
+
+def _units(text, counter, max_tokens):
+    segments = list(_segments(text))
+    counts = counter.count([text[start:end] for start, end, _, _ in segments])
+    for (start, end, page, heading), tokens in zip(segments, counts):
+        unit = _Unit(start, end, page, heading, tokens)
+        if tokens > max_tokens:
+            yield from _split_long(text, unit, counter, max_tokens)
+        else:
+            yield unit
+
+
+def _make_chunk(text, units):
+    start, end = units[0].start, units[-1].end
+    return Chunk(
+        text=text[start:end].replace(PAGE_BREAK, "\n\n"),
+        page_start=units[0].page,
+        page_end=units[-1].page,
+        char_start=start,
+        char_end=end,
+    )
+
+
+def split_document(text, counter=None, max_tokens=None, overlap_tokens=None):
+    """
+    Split extracted document text (pages joined with PAGE_BREAK) into
+    Chunks of at most max_tokens tokens. Consecutive chunks within a
+    section share up to overlap_tokens tokens of whole sentences.
+    """
+    counter = counter or get_token_counter()
+    max_tokens = max_tokens or settings.RAG_CHUNK_TOKENS
+    if counter.max_tokens:
+        max_tokens = min(max_tokens, counter.max_tokens)
+    if overlap_tokens is None:
+        overlap_tokens = settings.RAG_CHUNK_OVERLAP_TOKENS
+
+    chunks, current = [], []
+
+    def flush(overlap):
+        chunks.append(_make_chunk(text, current))
+        tail, tokens = [], 0
+        # Carry trailing sentences (never the whole chunk) into the next one
+        for unit in reversed(current[1:]):
+            if unit.heading or tokens + unit.tokens > overlap:
+                break
+            tail.insert(0, unit)
+            tokens += unit.tokens
+        current[:] = tail
+        return tokens
+
+    size = 0
+    for unit in _units(text, counter, max_tokens):
+        if current and not current[-1].heading:
+            # A heading opens a new section; a page break ends the chunk
+            # unless that would leave it small
+            if unit.heading or (unit.page != current[-1].page and size >= max_tokens // 2):
+                size = flush(0)
+        if current and size + unit.tokens > max_tokens:
+            size = flush(0 if unit.heading else overlap_tokens)
+            if size + unit.tokens > max_tokens:
+                current.clear()
+                size = 0
+        current.append(unit)
+        size += unit.tokens
+    if current:
+        chunks.append(_make_chunk(text, current))
+    return chunks
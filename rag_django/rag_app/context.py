@@ -0,0 +1,124 @@
+"""
+Context assembly between retrieval and the LLM call. Retrieved chunks
+are filtered and trimmed so that every prompt fits RAG_CONTEXT_TOKENS,
+however many chunks retrieval returns or how large they are:
+
+1. optionally, vector-only hits much further from the question than the
+   best match are dropped;
+2. sentences already included (chunk overlaps, repeated passages) are skipped;
+3. optionally, only the sentences sharing the most terms with the question
+   are kept from each chunk;
+4. chunks are added in rank order until the token budget is spent.
+"""
+import logging
+import math
+
+from django.conf import settings
+
+from . import metrics
+from .chunking import get_token_counter, split_sentences
+from .lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(sentence):
+    return " ".join(sentence.lower().split())
+
+
+def drop_low_scores(docs, ratio=None):
+    """
+    Drop vector-only hits whose L2 distance exceeds `ratio` times the
+    closest chunk's. Chunks with BM25 evidence (exact codes and ids) are
+    kept whatever their vector distance, as are the best-ranked chunk and
+    reranked results: the reranker already chose them.
+    """
+    ratio = settings.RAG_CONTEXT_DISTANCE_RATIO if ratio is None else ratio
+    distances = [doc.metadata.get('score') for doc in docs if doc.metadata.get('score') is not None]
+    reranked = any(doc.metadata.get('rerank_score') is not None for doc in docs)
+    if not ratio or not distances or reranked:
+        return docs
+    # Stored scores are squared L2 distances
+    cutoff = math.sqrt(max(min(distances), 0.0)) * ratio
+    return docs[:1] + [
+        doc for doc in docs[1:]
+        if doc.metadata.get('score') is None
+        or doc.metadata.get('bm25_score') is not None
+        or math.sqrt(max(doc.metadata['score'], 0.0)) <= cutoff
+    ]
+
+
+def best_sentences(sentences, question_terms, limit):
+    """Up to `limit` sentences sharing the most terms with the question, in their original order."""
+    if len(sentences) <= limit:
+        return sentences
+    overlap = [len(question_terms.intersection(tokenize(sentence))) for sentence in sentences]
+    ranked = sorted(range(len(sentences)), key=lambda i: (-overlap[i], i))[:limit]
+    return [sentences[i] for i in sorted(ranked)]
+
+
+def _truncate(sentence, budget, counter):
+    """Leading words of a sentence that fit in `budget` tokens."""
+    words = sentence.split()
+    kept, tokens = [], 0
+    for word, count in zip(words, counter.count(words)):
+        if tokens + count > budget:
+            break
+        kept.append(word)
+        tokens += count
+    return " ".join(kept), tokens
+
+
+def assemble_context(question, docs, template, counter=None, budget=None):
+    """
+    Fit retrieved docs into the context token budget. Returns the docs to
+    send, with trimmed page_content where sentences were removed, and
+    the token count of `template` formatted with them and the question.
+    """
+    counter = counter or get_token_counter()
+    budget = budget or settings.RAG_CONTEXT_TOKENS
+    extract = settings.RAG_CONTEXT_EXTRACT_SENTENCES
+    question_terms = set(tokenize(question))
+
+    ranked = drop_low_scores(docs)
+    metrics.context_chunks.inc(len(docs) - len(ranked), result='low_score')
+
+    seen, used, total = set(), [], 0
+    for position, doc in enumerate(ranked):
+        sentences = split_sentences(doc.page_content)
+        fresh = [sentence for sentence in sentences if _normalize(sentence) not in seen]
+        if not fresh:
+            metrics.context_chunks.inc(result='duplicate')
+            continue
+        if extract:
+            fresh = best_sentences(fresh, question_terms, settings.RAG_CONTEXT_SENTENCES_PER_CHUNK)
+
+        kept = []
+        for sentence, tokens in zip(fresh, counter.count(fresh)):
+            if total + tokens > budget:
+                if not used and not kept:
+                    # Never send an empty context because of one huge sentence
+                    sentence, tokens = _truncate(sentence, budget - total, counter)
+                    kept.append(sentence)
+                    total += tokens
+                break
+            kept.append(sentence)
+            total += tokens
+        if not kept:
+            metrics.context_chunks.inc(len(ranked) - position, result='over_budget')
+            break
+
+        seen.update(_normalize(sentence) for sentence in kept)
+        content = doc.page_content if kept == sentences else " ".join(kept)
+        used.append(type(doc)(page_content=content, metadata=doc.metadata))
+        metrics.context_chunks.inc(result='used' if kept == sentences else 'trimmed')
+        if len(kept) < len(fresh):
+            metrics.context_chunks.inc(len(ranked) - position - 1, result='over_budget')
+            break
+
+    prompt = template.format(context="\n\n".join(doc.page_content for doc in used), question=question)
+    prompt_tokens = counter.count([prompt])[0]
+    metrics.prompt_tokens.observe(prompt_tokens)
+    logger.debug("Context: %d of %d chunks, %d context tokens, %d prompt tokens",
+                len(used), len(docs), total, prompt_tokens)
+    return used, prompt_tokens
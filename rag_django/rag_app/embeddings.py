@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+
+# One embedding model per worker process, shared by every request
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def _configure_threads():
+    """Apply the configured torch thread limit (0 keeps the library default)."""
+    num_threads = getattr(settings, 'RAG_EMBEDDING_THREADS', 0)
+    if not num_threads:
+        return
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+
+def get_embeddings():
+    """
+    Return the process-wide embedding model, loading it on first use.
+    The model library is imported here too, so processes that never
+    embed anything never load it.
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+
+                _configure_threads()
+                _embeddings = HuggingFaceEmbeddings(
+                    model_name=settings.RAG_EMBEDDING_MODEL,
+                    model_kwargs={'device': settings.RAG_EMBEDDING_DEVICE},
+                    encode_kwargs={'batch_size': settings.RAG_EMBEDDING_BATCH_SIZE},
+                )
+    return _embeddings
+
+
+@contextmanager
+def use_embeddings(model):
+    """
+    Serve every embedding in this process from `model` inside the block,
+    for offline runs such as the benchmark. Vectors are still stored under
+    the configured model's id, so use it only with throwaway data.
+    """
+    global _embeddings
+    with _embeddings_lock:
+        previous, _embeddings = _embeddings, model
+    try:
+        yield model
+    finally:
+        with _embeddings_lock:
+            _embeddings = previous
+
+
+def embed_documents(texts):
+    """Embed a batch of texts with the shared model."""
+    if not texts:
+        return []
+    texts = list(texts)
+    metrics.embedding_batch_size.observe(len(texts), kind='documents')
+    with metrics.span('embed_documents'):
+        return get_embeddings().embed_documents(texts)
+
+
+class QueryBatcher:
+    """
+    Coalesces query embeddings from concurrent requests into one forward
+    pass. A background thread takes the first waiting query, collects
+    more for up to `max_wait` seconds or until `max_batch_size`, embeds
+    them together and hands each caller its own vector.
+    """
+
+    def __init__(self, embed_batch, max_batch_size, max_wait):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.queries = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _ensure_thread(self):
+        # Started lazily so forked worker processes each get their own
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="rag-query-embed", daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                # Always take what is already queued, then wait out the window
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # The same question asked concurrently is embedded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            metrics.embedding_batch_size.observe(len(texts), kind='query')
+            try:
+                vectors = dict(zip(texts, self.embed_batch(texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            for text, future in batch:
+                future.set_result(vectors[text])
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'mean_batch_size': round(self.queries / self.batches, 2) if self.batches else 0,
+        }
+
+
+_query_batcher = None
+_query_batcher_lock = threading.Lock()
+
+
+def get_query_batcher():
+    global _query_batcher
+    if _query_batcher is None:
+        with _query_batcher_lock:
+            if _query_batcher is None:
+                _query_batcher = QueryBatcher(
+                    lambda texts: get_embeddings().embed_documents(texts),
+                    max_batch_size=settings.RAG_QUERY_BATCH_SIZE,
+                    max_wait=settings.RAG_QUERY_BATCH_WAIT_MS / 1000,
+                )
+    return _query_batcher
+
+
+def embed_query(text):
+    """
+    Embed a single question with the shared model, batched together with
+    questions from concurrent requests unless RAG_QUERY_BATCH_SIZE is 1.
+    """
+    with metrics.span('embed_query'):
+        if settings.RAG_QUERY_BATCH_SIZE <= 1:
+            return get_embeddings().embed_query(text)
+        return get_query_batcher().embed(text)
+
+
+def _collect_metrics():
+    if _query_batcher is None:
+        return []
+    stats = _query_batcher.stats()
+    return [
+        ('rag_query_embedding_batches_total', 'counter', "Batched query embedding passes.", stats['batches']),
+        ('rag_query_embedding_queries_total', 'counter', "Queries embedded through the batcher.", stats['queries']),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def warm_up():
+    """
+    Load the model and run one forward pass so the first real request
+    does not pay the cold-load cost.
+    """
+    embed_query("warm up")
+
+
+def embedding_model_id():
+    """
+    Identity of the configured model, stored next to persisted vectors.
+    Bump RAG_EMBEDDING_MODEL_VERSION to force re-embedding.
+    """
+    version = getattr(settings, 'RAG_EMBEDDING_MODEL_VERSION', '')
+    if version:
+        return f"{settings.RAG_EMBEDDING_MODEL}@{version}"
+    return settings.RAG_EMBEDDING_MODEL
+
+
+def encode_vector(vector):
+    """Pack a vector into bytes using the configured storage dtype."""
+    dtype = settings.RAG_EMBEDDING_STORAGE_DTYPE
+    return np.asarray(vector, dtype=dtype).tobytes(), dtype
+
+
+def decode_vector(data, dtype):
+    return np.frombuffer(bytes(data), dtype=dtype).astype('float32')
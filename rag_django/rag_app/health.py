@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency that is known to be down."""
+
+    def __init__(self, name, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"{name} is unavailable, retry in {int(retry_after) + 1}s.")
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker. After `failure_threshold` consecutive
+    failures it opens and rejects calls for `reset_timeout` seconds, then
+    lets a single trial call through (half-open) to decide whether to close.
+    A trial that reports neither outcome within `reset_timeout` counts as
+    a failure, so an abandoned trial cannot hold the breaker half-open.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        if self.state == self.HALF_OPEN and self._trial_in_flight:
+            return max(0.0, self._trial_started_at + self.reset_timeout - time.monotonic())
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def allow(self):
+        """Return True if a call may proceed now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.retry_after() <= 0:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if (self.state == self.HALF_OPEN and self._trial_in_flight
+                    and time.monotonic() - self._trial_started_at > self.reset_timeout):
+                # The trial never reported back; treat it as failed
+                self.failures += 1
+                self._open()
+                return False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                self._trial_started_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._open()
+
+    def release_trial(self):
+        """
+        Give up a call that ended without an outcome (client disconnect,
+        cancellation), so the next caller can run the half-open trial.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release_trial()
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, func, *args, **kwargs):
+        """Like call(), for coroutine functions."""
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_after())
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancelled: no verdict on the dependency either way
+            self.release_trial()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'retry_after': round(self.retry_after(), 1) if self.state == self.OPEN else 0,
+        }
+
+
+llm_breaker = CircuitBreaker(
+    'LLM service',
+    failure_threshold=getattr(settings, 'RAG_LLM_BREAKER_FAILURES', 5),
+    reset_timeout=getattr(settings, 'RAG_LLM_BREAKER_RESET_SECONDS', 30),
+)
+
+
+class DependencyHealth:
+    """
+    Cached health of an external dependency. The probe runs on a background
+    thread at most once per `ttl` seconds; callers only ever read the cached
+    result, so requests never wait on it. Until the first probe completes
+    the dependency is assumed healthy.
+    """
+
+    def __init__(self, name, probe, ttl):
+        self.name = name
+        self.probe = probe
+        self.ttl = ttl
+        self.healthy = True
+        self.detail = 'not checked yet'
+        self.checked_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            healthy, detail = self.probe()
+        except Exception as e:
+            healthy, detail = False, str(e)
+        with self._lock:
+            self.healthy, self.detail = healthy, detail
+            self.checked_at = time.monotonic()
+            self._refreshing = False
+
+    def is_healthy(self):
+        with self._lock:
+            stale = self.checked_at is None or time.monotonic() - self.checked_at > self.ttl
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, name="rag-health-check", daemon=True).start()
+            return self.healthy
+
+    def snapshot(self):
+        age = None if self.checked_at is None else round(time.monotonic() - self.checked_at, 1)
+        return {'healthy': self.healthy, 'detail': self.detail, 'checked_seconds_ago': age}
+
+
+def _probe_gemini():
+    """Cheap authenticated call to the Gemini API we actually depend on."""
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        return False, "Google API key not found."
+    response = requests.get(
+        "https://generativelanguage.googleapis.com/v1beta/models",
+        params={'key': api_key, 'pageSize': 1},
+        timeout=getattr(settings, 'RAG_HEALTH_CHECK_TIMEOUT', 5),
+    )
+    # 429 means we are throttled, not that the service is down
+    healthy = response.status_code < 400 or response.status_code == 429
+    return healthy, f"HTTP {response.status_code}"
+
+
+llm_health = DependencyHealth(
+    'LLM service', _probe_gemini, ttl=getattr(settings, 'RAG_HEALTH_CHECK_TTL', 30)
+)
+
+
+def check_llm_available():
+    """
+    Fail fast when the LLM backend is known to be down, using only cached
+    state. Raises CircuitOpenError; returns None when calls may proceed.
+    """
+    if llm_breaker.state == CircuitBreaker.OPEN and llm_breaker.retry_after() > 0:
+        raise CircuitOpenError(llm_breaker.name, llm_breaker.retry_after())
+    if getattr(settings, 'RAG_HEALTH_CHECK_ENABLED', True) and not llm_health.is_healthy():
+        raise CircuitOpenError(llm_health.name, llm_health.ttl)
+
+
+def status():
+    return {'llm': llm_health.snapshot(), 'llm_circuit': llm_breaker.snapshot()}
@@ -0,0 +1,385 @@
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Document, DocumentChunk
+from . import metrics
+from .chunking import PAGE_BREAK, split_document
+
+# PDF parsing and the vector store pull in PyPDF2 and faiss; they are
+# imported where used so that the upload and status views, which import
+# this module, stay cheap to load.
+
+logger = logging.getLogger(__name__)
+
+# --- Unicode sanitization helper ---
+def _sanitize_text(value):
+    """
+    Remove surrogate code points and replace invalid sequences so the text
+    is safe for UTF-8 encoding, DB storage, and JSON serialization.
+    """
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        try:
+            value = str(value)
+        except Exception:
+            return ""
+    # Replace isolated surrogates and ensure valid UTF-8
+    # Encode with surrogatepass then decode ignoring invalids to drop any leftovers
+    try:
+        safe = value.encode('utf-8', 'surrogatepass').decode('utf-8', 'ignore')
+    except Exception:
+        # Fallback path if above fails for some reason
+        safe = value.encode('utf-8', 'ignore').decode('utf-8', 'ignore')
+    # Also normalize whitespace a bit
+    return safe.replace('\r\n', '\n').replace('\r', '\n')
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                # spawn, not fork: ingestion runs in threads of a Django process
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=settings.RAG_PDF_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _pdf_pool
+
+
+def _reset_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False)
+        _pdf_pool = None
+
+
+def _extract_pages_parallel(file_path, num_pages):
+    """Fan page ranges out to the process pool and collect them in order."""
+    from .pdf_pages import extract_page_range
+    # Several ranges per worker so one slow range doesn't idle the rest
+    step = max(1, math.ceil(num_pages / (settings.RAG_PDF_WORKERS * 4)))
+    ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+    pool = _get_pdf_pool()
+    futures = [pool.submit(extract_page_range, file_path, start, stop) for start, stop in ranges]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+def get_pdf_text(file_path):
+    """
+    Extract text from a PDF file given its path. Large files are split
+    into page ranges and extracted in parallel worker processes.
+    """
+    from .pdf_pages import count_pages, extract_page_range
+
+    try:
+        logger.debug("Reading PDF from path: %s", file_path)
+
+        # Check if file exists
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"PDF file not found at path: {file_path}")
+
+        with metrics.span('pdf_extract'):
+            num_pages = count_pages(file_path)
+            pages = None
+            if settings.RAG_PDF_WORKERS > 1 and num_pages >= settings.RAG_PDF_PARALLEL_MIN_PAGES:
+                try:
+                    pages = _extract_pages_parallel(file_path, num_pages)
+                except BrokenProcessPool as e:
+                    logger.warning("PDF worker pool failed, extracting serially: %s", e)
+                    _reset_pdf_pool()
+            if pages is None:
+                pages = extract_page_range(file_path, 0, num_pages)
+
+            # Sanitize page text to avoid surrogate errors, then join once
+            text = PAGE_BREAK.join(_sanitize_text(page) for page in pages)
+        logger.info("Extracted %d characters from %d pages of %s", len(text), num_pages, file_path)
+        return text
+
+    except FileNotFoundError as e:
+        logger.error("File not found error: %s", e)
+        raise e
+    except Exception as e:
+        logger.error("Error reading PDF: %s", e)
+        raise Exception(f"Error reading PDF: {str(e)}")
+
+
+# Split text into chunks
+def get_document_chunks(text):
+    """
+    Split extracted text into token-sized chunks that keep their page
+    numbers and character offsets (see chunking.split_document).
+    """
+    text = _sanitize_text(text)
+    if not text.strip():
+        raise Exception("No text extracted from PDF.")
+
+    with metrics.span('chunk'):
+        return split_document(text)
+
+
+def get_text_chunks(text):
+    return [chunk.text for chunk in get_document_chunks(text)]
+
+
+# --- Ingestion jobs ---
+# A Document row is the job: status/progress live on it, so any process
+# sharing the database can claim and run pending uploads.
+
+def _set_progress(document, progress, **fields):
+    fields['progress'] = progress
+    fields['updated_at'] = timezone.now()
+    Document.objects.filter(pk=document.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(document, name, value)
+
+
+def _discard_chunks(document):
+    from . import vector_store
+
+    chunk_ids = list(DocumentChunk.objects.filter(document=document).values_list('pk', flat=True))
+    if chunk_ids:
+        DocumentChunk.objects.filter(pk__in=chunk_ids).delete()
+        vector_store.remove_chunks(document.user, chunk_ids)
+
+
+def ingest_document(document):
+    """
+    Run the full pipeline for one document: extract, chunk, store chunks,
+    update the user's vector index and mark the document processed.
+    Failures are recorded on the document instead of raised.
+    """
+    from . import vector_store
+
+    try:
+        # A requeued job may have left chunks behind before it died
+        _discard_chunks(document)
+
+        logger.info("Ingesting document %s (%s)", document.pk, document.file.name)
+        raw_text = get_pdf_text(document.file.path)
+        raw_text = _sanitize_text(raw_text)
+        _set_progress(document, 30)
+
+        text_chunks = get_document_chunks(raw_text)
+        _set_progress(document, 40)
+        metrics.chunks_per_document.observe(len(text_chunks))
+        logger.debug("Created %d text chunks", len(text_chunks))
+
+        # Save chunks to database in batched INSERTs within one transaction
+        with metrics.span('store_chunks'), transaction.atomic():
+            DocumentChunk.objects.bulk_create(
+                [
+                    DocumentChunk(
+                        document=document,
+                        chunk_text=chunk.text,
+                        chunk_index=i,
+                        page_start=chunk.page_start,
+                        page_end=chunk.page_end,
+                        char_start=chunk.char_start,
+                        char_end=chunk.char_end,
+                    )
+                    for i, chunk in enumerate(text_chunks)
+                ],
+                batch_size=settings.RAG_CHUNK_BATCH_SIZE,
+            )
+        _set_progress(document, 60)
+
+        # Append only the new chunks to the vector store. bulk_create does not
+        # return primary keys on MySQL, so the store reads back just (pk, text).
+        with metrics.span('index_update'):
+            vector_store.add_chunks(document.user, DocumentChunk.objects.filter(document=document))
+
+        _set_progress(document, 100, processed=True, status=Document.STATUS_COMPLETED, error='')
+        metrics.documents_ingested.inc(status=Document.STATUS_COMPLETED)
+        logger.info("Document %s processed: %d chunks", document.pk, len(text_chunks))
+        return True
+
+    except Exception as e:
+        logger.exception("Error ingesting document %s", document.pk)
+        metrics.documents_ingested.inc(status=Document.STATUS_FAILED)
+        # Leave no half-indexed chunks behind. Cleanup can fail for the same
+        # reason ingestion did; the document must still end up failed with
+        # the original error rather than stuck in processing.
+        try:
+            _discard_chunks(document)
+        except Exception:
+            logger.exception("Error discarding chunks of document %s", document.pk)
+        _set_progress(
+            document, 0,
+            processed=False,
+            status=Document.STATUS_FAILED,
+            error=f"Failed to process PDF: {str(e)}",
+        )
+        return False
+
+
+def claim_next_document():
+    """
+    Atomically move the oldest pending document to processing and return
+    it, or None when the queue is empty. The conditional UPDATE makes the
+    claim safe across threads and processes without row locks.
+    """
+    while True:
+        pk = Document.objects.filter(
+            status=Document.STATUS_PENDING
+        ).order_by('uploaded_at', 'pk').values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        claimed = Document.objects.filter(pk=pk, status=Document.STATUS_PENDING).update(
+            status=Document.STATUS_PROCESSING,
+            progress=10,
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            return Document.objects.select_related('user').get(pk=pk)
+
+
+def requeue_stale_documents():
+    """Return documents stuck in processing (e.g. after a crash) to the queue."""
+    cutoff = timezone.now() - timedelta(seconds=settings.RAG_INGESTION_STALE_SECONDS)
+    return Document.objects.filter(
+        status=Document.STATUS_PROCESSING, updated_at__lt=cutoff
+    ).update(status=Document.STATUS_PENDING, progress=0, updated_at=timezone.now())
+
+
+def process_pending():
+    """Drain the queue, returning the number of documents processed."""
+    count = 0
+    try:
+        requeue_stale_documents()
+        while True:
+            document = claim_next_document()
+            if document is None:
+                return count
+            ingest_document(document)
+            count += 1
+    finally:
+        close_old_connections()
+
+
+def run_worker(poll_interval=None, once=False):
+    """Blocking worker loop for a dedicated ingestion process."""
+    poll_interval = poll_interval or settings.RAG_INGESTION_POLL_SECONDS
+    while True:
+        processed = process_pending()
+        if once:
+            return processed
+        if not processed:
+            time.sleep(poll_interval)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.RAG_INGESTION_WORKERS,
+                    thread_name_prefix='rag-ingest',
+                )
+    return _executor
+
+
+_drainer = None
+_drain_future = None
+_drain_lock = threading.Lock()
+
+
+def _drain():
+    try:
+        process_pending()
+    except Exception:
+        logger.exception("Ingestion drain failed")
+
+
+def _submit_drain():
+    """Queue a drain unless one is already waiting or running."""
+    global _drain_future
+    with _drain_lock:
+        if _drain_future is None or _drain_future.done():
+            _drain_future = _get_executor().submit(_drain)
+
+
+def _drain_periodically(interval):
+    while True:
+        _submit_drain()
+        time.sleep(interval)
+
+
+def start_drainer(interval=None):
+    """
+    In 'thread' mode, drain the queue now and then every `interval`
+    seconds, so documents left pending by a restart, or by an upload
+    whose on_commit hook never ran, are still picked up. Idempotent.
+    """
+    global _drainer
+    if settings.RAG_INGESTION_MODE != 'thread':
+        return
+    interval = interval or settings.RAG_INGESTION_POLL_SECONDS
+    with _drain_lock:
+        if _drainer is not None:
+            return
+        _drainer = threading.Thread(
+            target=_drain_periodically, args=(interval,), name='rag-ingest-drain', daemon=True
+        )
+        _drainer.start()
+
+
+def enqueue(document):
+    """
+    Queue a saved document for ingestion. In 'thread' mode a local worker
+    pool picks it up once the upload transaction commits (start_drainer()
+    catches anything that slips through); in 'worker' mode
+    it is left for `manage.py run_ingestion_worker`; 'sync' runs it inline.
+    """
+    mode = settings.RAG_INGESTION_MODE
+    if mode == 'sync':
+        claimed = Document.objects.filter(pk=document.pk, status=Document.STATUS_PENDING).update(
+            status=Document.STATUS_PROCESSING, progress=10
+        )
+        if claimed:
+            ingest_document(document)
+        return
+    if mode == 'thread':
+        transaction.on_commit(lambda: _get_executor().submit(process_pending))
+
+
+def wait_for_document(document, timeout):
+    """
+    Long-poll helper: block until the document reaches a final state or
+    its progress changes, for at most `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    start = (document.status, document.progress)
+    while time.monotonic() < deadline:
+        if document.status in (Document.STATUS_COMPLETED, Document.STATUS_FAILED):
+            break
+        time.sleep(settings.RAG_INGESTION_LONG_POLL_INTERVAL)
+        document.refresh_from_db(fields=['status', 'progress', 'processed', 'error', 'updated_at'])
+        if (document.status, document.progress) != start:
+            break
+    return document
@@ -0,0 +1,182 @@
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from urllib.parse import quote
+
+# Words joined by - _ . / are kept whole as well as split, so course codes
+# ("cs-101"), ids ("bcs.2021.045") and formula names match exactly
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_SEPARATOR_RE = re.compile(r"[-_./]")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in into is it
+its me my no not of on or our she so that the their them then there these they
+this to was we were what when where which who why will with you your
+""".split())
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """Lowercased terms of the text, without stopwords."""
+    terms = []
+    for token in _TOKEN_RE.findall((text or "").lower()):
+        if _SEPARATOR_RE.search(token):
+            terms.append(token)
+            terms.extend(part for part in _SEPARATOR_RE.split(token) if part not in STOPWORDS)
+        elif token not in STOPWORDS:
+            terms.append(token)
+    return terms
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    chunk_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);
+CREATE TABLE IF NOT EXISTS lengths (chunk_id INTEGER PRIMARY KEY, length INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), chunks INTEGER, total_length INTEGER);
+INSERT OR IGNORE INTO stats VALUES (0, 0, 0);
+"""
+
+# SQLite page cache per open shard; the file itself is memory-mapped, so
+# reads of hot postings are served from the shared OS page cache
+_CACHE_KIB = 2048
+_MMAP_BYTES = 1 << 30
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk texts, keyed by DocumentChunk pk and
+    stored in SQLite, one row per (term, chunk). Opening a shard reads
+    nothing up front: a query fetches only its terms' postings, and adds
+    and removes write only the affected rows.
+
+    Without a path the index lives in memory until save() copies it to
+    disk. With read_only=True the file is opened for searching only.
+    """
+
+    def __init__(self, path=None, read_only=False):
+        self.path = path
+        if path is None:
+            self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        elif read_only:
+            uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(f"PRAGMA cache_size = -{_CACHE_KIB}")
+        if path is not None:
+            self.conn.execute(f"PRAGMA mmap_size = {_MMAP_BYTES}")
+        if not read_only:
+            self.conn.executescript(_SCHEMA)
+        # One connection is shared by every thread using the cached shard
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._stats()[0]
+
+    @property
+    def nbytes(self):
+        """Private memory: the page cache, or the whole database when in memory."""
+        if self.path is not None:
+            return _CACHE_KIB * 1024
+        with self._lock:
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    def _stats(self):
+        with self._lock:
+            return self.conn.execute("SELECT chunks, total_length FROM stats").fetchone()
+
+    def add(self, chunk_id, text):
+        chunk_id = int(chunk_id)
+        terms = tokenize(text)
+        with self._lock:
+            inserted = self.conn.execute(
+                "INSERT OR IGNORE INTO lengths VALUES (?, ?)", (chunk_id, len(terms))
+            ).rowcount
+            if not inserted:
+                return
+            self.conn.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                [(term, chunk_id, tf) for term, tf in Counter(terms).items()],
+            )
+            self.conn.execute(
+                "UPDATE stats SET chunks = chunks + 1, total_length = total_length + ?", (len(terms),)
+            )
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                row = self.conn.execute(
+                    "SELECT length FROM lengths WHERE chunk_id = ?", (int(chunk_id),)
+                ).fetchone()
+                if row is None:
+                    continue
+                self.conn.execute("DELETE FROM lengths WHERE chunk_id = ?", (int(chunk_id),))
+                self.conn.execute("DELETE FROM postings WHERE chunk_id = ?", (int(chunk_id),))
+                self.conn.execute(
+                    "UPDATE stats SET chunks = chunks - 1, total_length = total_length - ?", (row[0],)
+                )
+
+    def save(self, path):
+        """
+        Commit pending changes. An index opened from `path` is updated in
+        place; any other is copied to `path` and atomically swapped in.
+        """
+        with self._lock:
+            if self.path == path:
+                self.conn.commit()
+                return
+            self.conn.commit()
+            target = sqlite3.connect(path + ".tmp")
+            try:
+                self.conn.backup(target)
+            finally:
+                target.close()
+        os.replace(path + ".tmp", path)
+
+    def search(self, text, k=4):
+        """Return up to k (chunk_id, bm25_score) pairs, best first."""
+        n, total_length = self._stats()
+        if not n:
+            return []
+        avg_length = total_length / n or 1.0
+        scores = {}
+        for term in set(tokenize(text)):
+            with self._lock:
+                entries = self.conn.execute(
+                    "SELECT p.chunk_id, p.tf, l.length FROM postings p"
+                    " JOIN lengths l ON l.chunk_id = p.chunk_id WHERE p.term = ?",
+                    (term,),
+                ).fetchall()
+            if not entries:
+                continue
+            idf = math.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+            for chunk_id, tf, length in entries:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge ranked lists of (chunk_id, score) into one list of
+    (chunk_id, fused_score), best first. Only ranks are used, so the
+    lists' score scales need not be comparable.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,91 @@
+import time
+
+import faiss
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_app import vector_store
+from rag_app.models import DocumentChunk
+
+EF_SEARCH_VALUES = [16, 32, 64, 128, 256]
+NPROBE_VALUES = [1, 4, 8, 16, 32, 64]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure recall@k and search latency of the HNSW and IVF-PQ index "
+        "types against exact search, to choose RAG_INDEX_* settings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Use this user's stored chunk vectors")
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help="Use this many random vectors instead of real data")
+        parser.add_argument('--dim', type=int, default=384, help="Dimension of synthetic vectors")
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('-k', type=int, default=10)
+
+    def _load_vectors(self, options):
+        if options['synthetic']:
+            rng = np.random.default_rng(0)
+            return rng.standard_normal((options['synthetic'], options['dim'])).astype('float32')
+        if not options['user']:
+            raise CommandError("Pass --user <id> or --synthetic <count>.")
+        chunks = DocumentChunk.objects.filter(document__user_id=options['user'])
+        vectors = [v for _, batch in vector_store._iter_stored_vectors(chunks) for v in batch]
+        if not vectors:
+            raise CommandError("No stored vectors for that user; run rebuild_vector_indexes first.")
+        return np.asarray(vectors, dtype='float32')
+
+    def _time_search(self, index, queries, k, params):
+        latencies = []
+        found = []
+        for query in queries:
+            start = time.perf_counter()
+            if params is None:
+                _, ids = index.search(query[None, :], k)
+            else:
+                _, ids = index.search(query[None, :], k, params=params)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(ids[0])
+        return np.asarray(found), np.asarray(latencies)
+
+    def handle(self, *args, **options):
+        vectors = self._load_vectors(options)
+        count, dim = vectors.shape
+        k = min(options['k'], count)
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.choice(count, size=min(options['queries'], count), replace=False)]
+        ids = np.arange(count, dtype='int64')
+        self.stdout.write(f"{count} vectors, dim {dim}, {len(queries)} queries, recall@{k}")
+        self.stdout.write(f"{'index':<10}{'param':<16}{'recall':>8}{'mean ms':>10}{'p95 ms':>10}{'build s':>10}{'MB':>8}")
+
+        flat = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+        flat.add_with_ids(vectors, ids)
+        truth, latencies = self._time_search(flat, queries, k, None)
+        self._row('flat', '-', 1.0, latencies, 0.0, count * (dim * 4 + 8))
+
+        for kind, values, make_params in (
+            (vector_store.INDEX_HNSW, EF_SEARCH_VALUES, lambda v: faiss.SearchParametersHNSW(efSearch=v)),
+            (vector_store.INDEX_IVFPQ, NPROBE_VALUES, lambda v: faiss.SearchParametersIVF(nprobe=v)),
+        ):
+            start = time.perf_counter()
+            index = vector_store.build_faiss_index(kind, dim, count)
+            if not index.is_trained:
+                sample = vectors[rng.choice(count, size=min(count, settings.RAG_INDEX_TRAIN_SAMPLE), replace=False)]
+                index.train(sample)
+            index.add_with_ids(vectors, ids)
+            build_seconds = time.perf_counter() - start
+            chunk_index = vector_store.ChunkIndex(index, kind=kind)
+            for value in values:
+                found, latencies = self._time_search(index, queries, k, make_params(value))
+                recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+                name = 'efSearch' if kind == vector_store.INDEX_HNSW else 'nprobe'
+                self._row(kind, f"{name}={value}", recall, latencies, build_seconds, chunk_index.nbytes)
+
+    def _row(self, kind, param, recall, latencies, build_seconds, nbytes):
+        self.stdout.write(
+            f"{kind:<10}{param:<16}{recall:>8.3f}{latencies.mean():>10.3f}"
+            f"{np.percentile(latencies, 95):>10.3f}{build_seconds:>10.2f}{nbytes / 1e6:>8.1f}"
+        )
@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_app.benchmark import DatabaseNotAllowed, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark ingestion and question answering offline on synthetic "
+        "PDFs, with a fake LLM and hashing (or small local) embeddings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=3)
+        parser.add_argument('--pages', type=int, default=20, help="Pages per synthetic PDF")
+        parser.add_argument('--words-per-page', type=int, default=400)
+        parser.add_argument('--questions', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=1, help="Threads asking questions")
+        parser.add_argument('--llm-latency-ms', type=float, default=0.0,
+                            help="Simulated LLM response time")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--embedding-model',
+                            help="Local sentence-transformers model to use instead of hashing "
+                                 "embeddings, e.g. sentence-transformers/paraphrase-MiniLM-L3-v2")
+        parser.add_argument('--stream', action='store_true',
+                            help="Ask through the streaming (SSE) path")
+        parser.add_argument('--json', dest='json_path', help="Also write the report to this file")
+        parser.add_argument('--allow-database', action='store_true',
+                            help="Run against a database that is not a test database; a throwaway "
+                                 "user, its documents and index are created there and then deleted")
+
+    def handle(self, *args, **options):
+        try:
+            report = run_benchmark(
+                documents=options['documents'],
+                pages=options['pages'],
+                words_per_page=options['words_per_page'],
+                questions=options['questions'],
+                concurrency=options['concurrency'],
+                llm_latency=options['llm_latency_ms'] / 1000,
+                seed=options['seed'],
+                embedding_model=options['embedding_model'],
+                stream=options['stream'],
+                allow_database=options['allow_database'],
+                log=self.stdout.write,
+            )
+        except DatabaseNotAllowed as e:
+            raise CommandError(f"{e} Pass --allow-database to run anyway.")
+
+        self.stdout.write(f"{'stage':<24}{'n':>6}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for stage, row in report['stages'].items():
+            self.stdout.write(
+                f"{stage:<24}{row['count']:>6}{row['mean_ms']:>10.2f}{row['p50_ms']:>10.2f}"
+                f"{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}"
+            )
+        for name, value in report['throughput'].items():
+            self.stdout.write(f"{name}: {value}")
+        if report['rejected_questions']:
+            self.stdout.write(self.style.WARNING(f"rejected by admission control: {report['rejected_questions']}"))
+        self.stdout.write(f"peak RSS: {report['peak_rss_mb']} MB")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['json_path']}"))
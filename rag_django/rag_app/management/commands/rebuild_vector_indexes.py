@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from rag_app import vector_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild users' vector index shards from stored chunk embeddings, "
+        "re-embedding only chunks whose vectors came from another model"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="Only rebuild this user's shard (repeatable)")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(document__isnull=False).distinct()
+        if options['user_ids']:
+            users = users.filter(pk__in=options['user_ids'])
+        for user in users.iterator():
+            chunk_index = vector_store.rebuild_index(user)
+            count = chunk_index.live_count if chunk_index else 0
+            self.stdout.write(f"{user.username}: {count} vectors")
+        self.stdout.write(self.style.SUCCESS("Done"))
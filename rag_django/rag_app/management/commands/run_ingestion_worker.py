@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from rag_app import ingestion
+
+
+class Command(BaseCommand):
+    help = "Process uploaded documents waiting in the ingestion queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Drain the queue once and exit instead of polling forever",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=None,
+            help="Seconds to sleep when the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Ingestion worker started")
+        processed = ingestion.run_worker(
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+        )
+        if options['once']:
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} document(s)"))
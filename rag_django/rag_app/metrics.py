@@ -0,0 +1,182 @@
+"""
+In-process metrics for the RAG pipeline, exposed in the Prometheus text
+format by the metrics/ endpoint. Counters and histograms are updated
+where work happens; point-in-time values (cache sizes, queue depth) are
+read from registered collectors only when scraped.
+
+Metrics are per worker process; scrape every worker, or run one.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+TOKEN_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_metrics = []
+_collectors = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                total = counts[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {total}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {counts[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {total}")
+        return lines
+
+
+def register_collector(collect):
+    """
+    Add a callable returning (name, type, help, value) tuples, read at
+    scrape time. Modules register their own so that importing this one
+    never pulls in the ML stack.
+    """
+    _collectors.append(collect)
+
+
+stage_seconds = Histogram('rag_stage_seconds', "Time spent in each RAG pipeline stage.")
+chunks_per_document = Histogram('rag_chunks_per_document', "Chunks created per ingested document.", SIZE_BUCKETS)
+embedding_batch_size = Histogram('rag_embedding_batch_size', "Texts per embedding model call.", SIZE_BUCKETS)
+documents_ingested = Counter('rag_documents_ingested_total', "Documents ingested, by final status.")
+answer_cache_lookups = Counter('rag_answer_cache_lookups_total', "Answer cache lookups, by result.")
+llm_calls = Counter('rag_llm_calls_total', "LLM calls, by outcome.")
+prompt_tokens = Histogram('rag_prompt_tokens', "Tokens in each prompt sent to the LLM.", TOKEN_BUCKETS)
+context_chunks = Counter('rag_context_chunks_total', "Retrieved chunks by what context assembly did with them.")
+rerank_pairs = Counter('rag_rerank_pairs_total', "Question/chunk pairs by how the reranker handled them.")
+
+
+# --- Per-request stage timings, for the Server-Timing header ---
+
+_request_timings = contextvars.ContextVar('rag_request_timings', default=None)
+
+
+@contextmanager
+def span(stage):
+    """Time a pipeline stage into rag_stage_seconds and the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+        logger.debug("%s took %.1f ms", stage, elapsed * 1000)
+
+
+@contextmanager
+def collect_timings():
+    """Collect the spans run inside the block, in this thread or task, into the yielded list."""
+    timings = []
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def _server_timing(timings):
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings)
+
+
+def server_timing_middleware(get_response):
+    """
+    Collect the spans run while handling a request and, with
+    RAG_SERVER_TIMING on, report them in a Server-Timing header.
+    """
+    def finish(response, timings):
+        if timings and settings.RAG_SERVER_TIMING:
+            response['Server-Timing'] = _server_timing(timings)
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with collect_timings() as timings:
+                return finish(await get_response(request), timings)
+    else:
+        def middleware(request):
+            with collect_timings() as timings:
+                return finish(get_response(request), timings)
+    return middleware
+
+
+server_timing_middleware.async_capable = True
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        try:
+            samples = collect()
+        except Exception:
+            logger.exception("Metrics collector failed")
+            continue
+        for name, kind, help_text, value in samples:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
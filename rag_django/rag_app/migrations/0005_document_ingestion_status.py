@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+def mark_processed_completed(apps, schema_editor):
+    # Documents ingested before the job queue existed are already indexed
+    Document = apps.get_model('rag_app', 'Document')
+    Document.objects.filter(processed=True).update(status='completed', progress=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0004_auto_20250914_1200'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='progress',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(mark_processed_completed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0005_document_ingestion_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_dtype',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_model',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=200),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0006_documentchunk_embedding'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['user', 'uploaded_at'], name='rag_doc_user_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queryhistory',
+            index=models.Index(fields=['user', 'created_at'], name='rag_qh_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag_app', '0007_query_history_document_user_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['is_active', 'registration_date'], name='rag_student_active_reg_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['department', 'year_of_study', 'registration_date'], name='rag_student_dept_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['year_of_study', 'registration_date'], name='rag_student_year_reg_idx'),
+        ),
+    ]
@@ -39,20 +39,61 @@ class Student(models.Model):
     
     class Meta:
         ordering = ['-registration_date']
+        # Serve list_students' filters and newest-first pages from indexes
+        indexes = [
+            models.Index(fields=['is_active', 'registration_date'], name='rag_student_active_reg_idx'),
+            models.Index(fields=['department', 'year_of_study', 'registration_date'], name='rag_student_dept_year_idx'),
+            models.Index(fields=['year_of_study', 'registration_date'], name='rag_student_year_reg_idx'),
+        ]
 
 class Document(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     file = models.FileField(upload_to='documents/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
+    # Ingestion job state, polled by the client after upload
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    progress = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Backs the per-user, newest-first keyset pagination of documents
+        indexes = [models.Index(fields=['user', 'uploaded_at'], name='rag_doc_user_uploaded_idx')]
 
 class DocumentChunk(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE)
     chunk_text = models.TextField()
     chunk_index = models.IntegerField()
+    # Where the chunk came from: 1-based pages and character offsets into
+    # the extracted text. Null for chunks ingested before these were kept.
+    page_start = models.PositiveIntegerField(null=True, blank=True)
+    page_end = models.PositiveIntegerField(null=True, blank=True)
+    char_start = models.PositiveIntegerField(null=True, blank=True)
+    char_end = models.PositiveIntegerField(null=True, blank=True)
+    # Raw embedding vector, so indexes can be rebuilt without re-embedding.
+    # Only valid while embedding_model matches the configured model.
+    embedding = models.BinaryField(null=True, editable=False)
+    embedding_dtype = models.CharField(max_length=8, blank=True, default='')
+    embedding_model = models.CharField(max_length=200, blank=True, default='', db_index=True)
 
 class QueryHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     question = models.TextField()
     answer = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Backs the per-user, newest-first keyset pagination of history
+        indexes = [models.Index(fields=['user', 'created_at'], name='rag_qh_user_created_idx')]
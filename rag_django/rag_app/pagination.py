@@ -0,0 +1,73 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidPageRequest(Exception):
+    pass
+
+
+def is_paginated(request):
+    """Clients opt in by sending `limit` or `cursor`; others get the full list."""
+    return 'limit' in request.query_params or 'cursor' in request.query_params
+
+
+def page_size(request):
+    try:
+        limit = int(request.query_params.get('limit', settings.RAG_PAGE_SIZE))
+    except ValueError:
+        raise InvalidPageRequest("limit must be an integer.")
+    return max(1, min(limit, settings.RAG_MAX_PAGE_SIZE))
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([value.isoformat(), pk]).encode('utf-8')
+    # Unpadded, so the cursor needs no escaping in a query string
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii') + b'=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        value = parse_datetime(value)
+        if value is None:
+            raise ValueError
+        return value, int(pk)
+    except (ValueError, TypeError):
+        raise InvalidPageRequest("Invalid cursor.")
+
+
+def keyset_page(queryset, request, field):
+    """
+    Newest-first page of the queryset, continuing after the request's
+    cursor. Seeks on (field, id) instead of using OFFSET, so every page
+    costs one index range scan however deep the client has scrolled.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    limit = page_size(request)
+    queryset = queryset.order_by(f'-{field}', '-id')
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, field), last.pk)
+
+
+def requested_fields(request, allowed):
+    """Fields named in `?fields=a,b`, limited to `allowed` (None if absent)."""
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    selected = [name for name in fields.split(',') if name in allowed]
+    if not selected:
+        raise InvalidPageRequest(f"fields must be some of: {', '.join(allowed)}.")
+    return selected
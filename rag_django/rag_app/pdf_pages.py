@@ -0,0 +1,17 @@
+"""
+Page-range PDF text extraction. This module must stay free of Django
+imports so it can be loaded cheaply by spawned worker processes.
+"""
+import PyPDF2
+
+
+def count_pages(file_path):
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def extract_page_range(file_path, start, stop):
+    """Return the raw text of pages [start, stop), one string per page."""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, stop)]
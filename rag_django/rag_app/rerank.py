@@ -0,0 +1,160 @@
+"""
+Optional reranking of retrieved chunks. Retrieval over-fetches
+RAG_RERANK_CANDIDATES chunks; a scorer rescores them against the question
+and only the best RAG_RETRIEVAL_K go on to the LLM. Two scorers:
+
+- 'cross-encoder': a small sentence-transformers CrossEncoder, most accurate;
+- 'lexical': question-term and bigram coverage, no model and microseconds.
+
+Scoring runs in batches and stops starting new ones after
+RAG_RERANK_TIMEOUT_MS; unscored candidates keep their retrieval order
+behind the scored ones. (question, chunk) scores are cached per process.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+from .answer_cache import normalize_question
+from .lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def _bigrams(terms):
+    return set(zip(terms, terms[1:]))
+
+
+class LexicalScorer:
+    """Share of the question's terms, and of its term pairs, found in the chunk."""
+
+    name = 'lexical'
+
+    def score(self, question, texts):
+        question_terms = tokenize(question)
+        terms, bigrams = set(question_terms), _bigrams(question_terms)
+        scores = []
+        for text in texts:
+            text_terms = tokenize(text)
+            coverage = len(terms.intersection(text_terms)) / len(terms) if terms else 0.0
+            phrase = len(bigrams & _bigrams(text_terms)) / len(bigrams) if bigrams else 0.0
+            scores.append(coverage + 0.5 * phrase)
+        return scores
+
+
+class CrossEncoderScorer:
+    """Relevance logits from a sentence-transformers cross-encoder."""
+
+    def __init__(self, model_name):
+        from sentence_transformers import CrossEncoder
+
+        self.name = f"cross-encoder:{model_name}"
+        self.model = CrossEncoder(model_name, device=settings.RAG_EMBEDDING_DEVICE)
+
+    def score(self, question, texts):
+        pairs = [(question, text) for text in texts]
+        return [float(score) for score in self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+
+_cross_encoder = None
+_cross_encoder_failed = False
+_cross_encoder_lock = threading.Lock()
+
+
+def get_scorer():
+    """
+    The configured scorer, or None with reranking off. If the cross-encoder
+    cannot be loaded, lexical scoring is used instead of failing requests.
+    """
+    global _cross_encoder, _cross_encoder_failed
+    kind = settings.RAG_RERANK
+    if not kind:
+        return None
+    if kind == 'cross-encoder' and not _cross_encoder_failed:
+        if _cross_encoder is None:
+            with _cross_encoder_lock:
+                if _cross_encoder is None and not _cross_encoder_failed:
+                    try:
+                        _cross_encoder = CrossEncoderScorer(settings.RAG_RERANK_MODEL)
+                    except Exception:
+                        logger.exception("Could not load cross-encoder, reranking lexically")
+                        _cross_encoder_failed = True
+        if _cross_encoder is not None:
+            return _cross_encoder
+    return LexicalScorer()
+
+
+class ScoreCache:
+    """Bounded LRU of (scorer, question, chunk id) -> score."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            score = self._entries.get(key)
+            if score is not None:
+                self._entries.move_to_end(key)
+            return score
+
+    def put(self, key, score):
+        with self._lock:
+            self._entries[key] = score
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+score_cache = ScoreCache(getattr(settings, 'RAG_RERANK_CACHE_SIZE', 10000))
+
+
+def rerank(question, docs, top_k=None, scorer=None):
+    """
+    Reorder retrieved docs by scorer relevance and return the best top_k,
+    with each doc's score in metadata['rerank_score'] (None if unscored).
+    """
+    scorer = scorer or get_scorer()
+    top_k = top_k or settings.RAG_RETRIEVAL_K
+    if scorer is None or not docs:
+        return docs[:top_k]
+
+    normalized = normalize_question(question)
+    keys = [(scorer.name, normalized, doc.metadata.get('chunk_id')) for doc in docs]
+    scores = {}
+    pending = []
+    for i, key in enumerate(keys):
+        score = score_cache.get(key) if key[2] is not None else None
+        if score is None:
+            pending.append(i)
+        else:
+            scores[i] = score
+    metrics.rerank_pairs.inc(len(scores), result='cached')
+
+    batch_size = settings.RAG_RERANK_BATCH_SIZE
+    deadline = time.monotonic() + settings.RAG_RERANK_TIMEOUT_MS / 1000
+    for start in range(0, len(pending), batch_size):
+        if start and time.monotonic() >= deadline:
+            metrics.rerank_pairs.inc(len(pending) - start, result='skipped')
+            logger.debug("Rerank time cap hit, %d candidates left unscored", len(pending) - start)
+            break
+        batch = pending[start:start + batch_size]
+        for i, score in zip(batch, scorer.score(question, [docs[i].page_content for i in batch])):
+            scores[i] = score
+            if keys[i][2] is not None:
+                score_cache.put(keys[i], score)
+        metrics.rerank_pairs.inc(len(batch), result='scored')
+
+    order = sorted(scores, key=lambda i: (-scores[i], i)) + [i for i in range(len(docs)) if i not in scores]
+    reranked = []
+    for i in order[:top_k]:
+        docs[i].metadata['rerank_score'] = scores.get(i)
+        reranked.append(docs[i])
+    return reranked
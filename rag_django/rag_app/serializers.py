@@ -4,6 +4,14 @@ from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from django.core.exceptions import ValidationError
 
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """Takes an optional `fields` argument listing the fields to output."""
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -72,13 +80,13 @@ class StudentSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['registration_date']
 
-class DocumentSerializer(serializers.ModelSerializer):
+class DocumentSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Document
-        fields = ['id', 'file', 'uploaded_at', 'processed']
-        read_only_fields = ['uploaded_at', 'processed']
+        fields = ['id', 'file', 'uploaded_at', 'processed', 'status', 'progress', 'error']
+        read_only_fields = ['uploaded_at', 'processed', 'status', 'progress', 'error']
 
-class QueryHistorySerializer(serializers.ModelSerializer):
+class QueryHistorySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = QueryHistory
         fields = ['id', 'question', 'answer', 'created_at']
@@ -1,3 +1,852 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from langchain_core.documents import Document as LCDocument
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import async_views, embeddings, ingestion, vector_store, views
+from .admission import AdmissionLimiter, AdmissionRejected
+from .benchmark import WORDS, DatabaseNotAllowed, HashingEmbeddings, run_benchmark
+from .chunking import PAGE_BREAK, SimpleTokenCounter, split_document
+from .context import assemble_context, drop_low_scores
+from .health import CircuitBreaker
+from .lexical import LexicalIndex
+from .models import Document, DocumentChunk, QueryHistory, Student
+from .vector_store import INDEX_IVFPQ, ChunkIndex
+
+
+class ListStudentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='admin', password='password123')
+        for i in range(30):
+            user = User.objects.create_user(username=f'student{i}', email=f'student{i}@example.com')
+            Student.objects.create(
+                user=user,
+                student_id=f'S{i:04d}',
+                first_name='First',
+                last_name=f'Last{i}',
+                email=f'student{i}@example.com',
+                phone_number='+123456789',
+                date_of_birth=date(2000, 1, 1),
+                department='CS' if i % 2 else 'EE',
+                year_of_study=i % 4 + 1,
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for limit in (1, 5, 30):
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/rag/students/', {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_unpaginated_list_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/rag/students/')
+        self.assertEqual(len(response.data), 30)
+        self.assertEqual(response.data[0]['username'], 'student29')
+
+    def test_pages_cover_every_student_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 7}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/api/rag/students/', params)
+            seen += [student['student_id'] for student in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len(set(seen)), 30)
+
+    def test_filters(self):
+        response = self.client.get('/api/rag/students/', {'department': 'CS', 'year_of_study': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data)
+        for student in response.data:
+            self.assertEqual((student['department'], student['year_of_study']), ('CS', 2))
+
+        response = self.client.get('/api/rag/students/', {'year_of_study': 'two'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(
+            MEDIA_ROOT=os.path.join(directory.name, 'media'),
+            FAISS_INDEX_PATH=os.path.join(directory.name, 'faiss_index'),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.media_root = settings.MEDIA_ROOT
+
+    def test_small_offline_run_reports_every_stage(self):
+        report = run_benchmark(documents=1, pages=3, words_per_page=200, questions=5, log=lambda message: None)
+        self.assertLessEqual(
+            {'ingest_document', 'pdf_extract', 'chunk', 'store_chunks', 'index_update',
+             'answer', 'embed_query', 'retrieve', 'vector_search', 'assemble_context', 'llm'},
+            set(report['stages']),
+        )
+        # One retrieval per question: stages come from a single pass
+        self.assertEqual(report['stages']['answer']['count'], 5)
+        self.assertEqual(report['stages']['retrieve']['count'], 5)
+        self.assertEqual(report['rejected_questions'], 0)
+        self.assertGreater(report['throughput']['questions_per_second'], 0)
+        # The throwaway user, their documents and uploads are removed afterwards
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Document.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'documents')), [])
+        shards = [name for name in os.listdir(settings.FAISS_INDEX_PATH) if not name.startswith('.')]
+        self.assertEqual(shards, [])
+
+    def test_streaming_run_uses_a_chat_model(self):
+        report = run_benchmark(
+            documents=1, pages=2, words_per_page=100, questions=2, stream=True, log=lambda message: None
+        )
+        self.assertEqual(report['stages']['answer']['count'], 2)
+        self.assertEqual(report['rejected_questions'], 0)
+
+    def test_refuses_a_database_that_is_not_for_tests(self):
+        with mock.patch('rag_app.benchmark.is_test_database', return_value=False):
+            with self.assertRaises(DatabaseNotAllowed):
+                run_benchmark(documents=1, questions=1, log=lambda message: None)
+            with self.assertRaisesMessage(CommandError, '--allow-database'):
+                call_command('rag_benchmark', '--documents=1', '--questions=1', stdout=io.StringIO())
+        self.assertFalse(User.objects.exists())
+
+
+class ImportTimeTests(SimpleTestCase):
+    # Loading the URLconf happens in every manage.py command and worker
+    # boot; the ML stack must wait for the first RAG request
+    HEAVY_MODULES = (
+        'faiss', 'langchain', 'langchain_core', 'langchain_community', 'langchain_google_genai',
+        'langchain_text_splitters', 'PyPDF2', 'torch', 'sentence_transformers',
+    )
+    URLCONF_BUDGET_SECONDS = 1.0
+
+    def _importtime(self, code):
+        """Run `code` under `python -X importtime`; returns {module: cumulative seconds}."""
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        timings = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            timings[name.strip()] = int(cumulative) / 1e6
+        return timings
+
+    def test_url_loading_skips_ml_stack_and_stays_within_budget(self):
+        timings = self._importtime("import django; django.setup(); import rag_app.urls")
+        loaded = sorted(name for name in timings if name.split('.')[0] in self.HEAVY_MODULES)
+        self.assertEqual(loaded, [])
+        self.assertLess(timings['rag_app.urls'], self.URLCONF_BUDGET_SECONDS)
+
+
+@override_settings(RAG_INDEX_IVFPQ_MIN_VECTORS=10000, RAG_INDEX_TOMBSTONE_RATIO=0.2)
+class IvfPqCompactionTests(SimpleTestCase):
+    def test_search_returns_the_right_ids_after_compaction(self):
+        vectors = np.random.default_rng(0).standard_normal((12000, 32)).astype('float32')
+        ids = np.arange(1, 12001)
+        chunk_index = ChunkIndex.create(32, len(vectors))
+        self.assertEqual(chunk_index.kind, INDEX_IVFPQ)
+        chunk_index.train(vectors)
+        chunk_index.add(ids, vectors)
+
+        # Past the tombstone ratio, so the vectors are removed for real
+        chunk_index.remove(ids[:2500])
+        self.assertEqual(chunk_index.index.ntotal, 9500)
+        self.assertFalse(chunk_index.tombstones)
+
+        survivors = range(2500, 3500)
+        found = sum(
+            chunk_index.search(vectors[i], k=1, nprobe=1024)[0][0] == ids[i] for i in survivors
+        )
+        self.assertGreaterEqual(found / len(survivors), 0.95)
+        self.assertFalse(any(
+            hit[0] <= 2500 for i in survivors for hit in chunk_index.search(vectors[i], k=3, nprobe=1024)
+        ))
+
+        with tempfile.TemporaryDirectory() as path:
+            chunk_index.save(path)
+            mapped = ChunkIndex.load(path, mmap=True)
+        self.assertTrue(mapped.mmapped)
+        self.assertEqual(mapped.search(vectors[3000], k=1, nprobe=1024)[0][0], ids[3000])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def _half_open(self, reset_timeout=0.05):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=reset_timeout)
+        breaker.record_failure()
+        time.sleep(reset_timeout * 1.5)
+        return breaker
+
+    def test_stale_trial_counts_as_failure(self):
+        breaker = self._half_open()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        time.sleep(0.075)
+        # The trial never reported back: the breaker reopens
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.075)
+        self.assertTrue(breaker.allow())
+
+    def test_cancelled_trial_is_released(self):
+        breaker = self._half_open()
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        async def cancel_trial():
+            task = asyncio.ensure_future(breaker.acall(hang))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_trial())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+
+class SplitDocumentTests(SimpleTestCase):
+    counter = SimpleTokenCounter()
+
+    def _text(self):
+        pages = [
+            "1 Introduction\n" + " ".join(f"Sentence {i} talks about retrieval." for i in range(60)),
+            "x" * 5000 + " and then normal words again. " + "word " * 300,
+            "APPENDIX\nhttps://example.com/" + "a1b2c3" * 400 + "\nShort closing line.",
+        ]
+        return PAGE_BREAK.join(pages)
+
+    def test_chunks_stay_within_max_tokens(self):
+        chunks = split_document(self._text(), counter=self.counter, max_tokens=100, overlap_tokens=20)
+        self.assertGreater(len(chunks), 10)
+        for chunk in chunks:
+            self.assertLessEqual(self.counter.count([chunk.text])[0], 100)
+
+    def test_offsets_and_pages_round_trip(self):
+        text = self._text()
+        chunks = split_document(text, counter=self.counter, max_tokens=100, overlap_tokens=20)
+        page_starts = [0]
+        for page in text.split(PAGE_BREAK)[:-1]:
+            page_starts.append(page_starts[-1] + len(page) + len(PAGE_BREAK))
+        for chunk in chunks:
+            self.assertEqual(text[chunk.char_start:chunk.char_end].replace(PAGE_BREAK, "\n\n"), chunk.text)
+            self.assertEqual(chunk.page_start, sum(start <= chunk.char_start for start in page_starts))
+            self.assertEqual(chunk.page_end, sum(start < chunk.char_end for start in page_starts))
+        # Every non-blank character of the document lands in some chunk
+        covered = set()
+        for chunk in chunks:
+            covered.update(range(chunk.char_start, chunk.char_end))
+        body = text.replace(PAGE_BREAK, " " * len(PAGE_BREAK))
+        self.assertFalse([i for i, c in enumerate(body) if not c.isspace() and i not in covered])
+
+
+class _User:
+    def __init__(self, pk):
+        self.pk = pk
+
+
+class AdmissionLimiterTests(SimpleTestCase):
+    def _limiter(self, max_concurrent=1, max_queue=10, max_wait=1.0, per_user=2):
+        return AdmissionLimiter('test', max_concurrent, max_queue, max_wait, per_user)
+
+    def test_per_user_cap_rejects_immediately(self):
+        limiter = self._limiter(max_concurrent=4, per_user=2)
+        alice = _User(1)
+        slots = [limiter.acquire(alice), limiter.acquire(alice)]
+        with self.assertRaises(AdmissionRejected):
+            limiter.acquire(alice)
+        # Other users are unaffected
+        limiter.acquire(_User(2)).release()
+        slots[0].release()
+        limiter.acquire(alice).release()
+
+    def test_waiters_are_admitted_round_robin(self):
+        limiter = self._limiter(max_concurrent=1, per_user=3)
+
+        async def scenario():
+            holder = await limiter.acquire_async(_User(0))
+            order = []
+
+            async def ask(user_id):
+                slot = await limiter.acquire_async(_User(user_id))
+                order.append(user_id)
+                slot.release()
+
+            tasks = []
+            for user_id in (1, 1, 1, 2, 2, 3):
+                tasks.append(asyncio.ensure_future(ask(user_id)))
+                await asyncio.sleep(0)
+            holder.release()
+            await asyncio.gather(*tasks)
+            return order
+
+        self.assertEqual(asyncio.run(scenario()), [1, 2, 3, 1, 2, 1])
+
+    def test_queued_caller_times_out(self):
+        limiter = self._limiter(max_wait=0.05)
+        slot = limiter.acquire(_User(1))
+        with self.assertRaises(AdmissionRejected):
+            limiter.acquire(_User(2))
+
+        async def wait_async():
+            with self.assertRaises(AdmissionRejected):
+                await limiter.acquire_async(_User(3))
+
+        asyncio.run(wait_async())
+        snapshot = limiter.snapshot()
+        self.assertEqual((snapshot['timed_out'], snapshot['queue_depth']), (2, 0))
+        slot.release()
+        self.assertEqual(limiter.snapshot()['active'], 0)
+
+    def test_release_hands_the_slot_to_the_next_waiter(self):
+        limiter = self._limiter()
+        slot = limiter.acquire(_User(1))
+        slot.release()
+        slot.release()
+        self.assertEqual(limiter.snapshot()['active'], 0)
+        with limiter.acquire(_User(1)):
+            self.assertEqual(limiter.snapshot()['active'], 1)
+        self.assertEqual(limiter.snapshot()['active'], 0)
+
+    def test_cancelled_waiter_frees_its_place(self):
+        limiter = self._limiter()
+
+        async def scenario():
+            holder = await limiter.acquire_async(_User(1))
+            waiter = asyncio.ensure_future(limiter.acquire_async(_User(2)))
+            await asyncio.sleep(0)
+            # Granted and cancelled in the same loop iteration: the slot
+            # must not leak
+            holder.release()
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            await asyncio.sleep(0.01)
+
+        asyncio.run(scenario())
+        snapshot = limiter.snapshot()
+        self.assertEqual((snapshot['active'], snapshot['queue_depth'], snapshot['timed_out']), (0, 0, 0))
+
+
+class LexicalIndexTests(SimpleTestCase):
+    texts = {
+        1: "The course CS-101 covers introduction to programming.",
+        2: "Lecture notes on linear algebra and matrices.",
+        3: "Programming assignments are due every Friday.",
+    }
+
+    def test_saved_index_is_updated_in_place(self):
+        index = LexicalIndex()
+        for chunk_id, text in self.texts.items():
+            index.add(chunk_id, text)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'lexical.sqlite3')
+            index.save(path)
+            reader = LexicalIndex(path, read_only=True)
+            self.assertEqual(len(reader), 3)
+            self.assertEqual([hit[0] for hit in reader.search("cs-101 programming")], [1, 3])
+
+            writer = LexicalIndex(path)
+            writer.remove([1])
+            writer.add(4, "Advanced programming in CS-101 labs.")
+            writer.add(4, "Added twice, indexed once.")
+            inode = os.stat(path).st_ino
+            writer.save(path)
+            self.assertEqual(os.stat(path).st_ino, inode)
+            # Committed rows are visible to an open reader straight away
+            self.assertEqual(len(reader), 3)
+            self.assertEqual([hit[0] for hit in reader.search("cs-101")], [4])
+            self.assertEqual(reader.search("twice"), [])
+
+
+def _doc(text, score=None, bm25_score=None):
+    return LCDocument(page_content=text, metadata={'score': score, 'bm25_score': bm25_score})
+
+
+class ContextAssemblyTests(SimpleTestCase):
+    template = "Context:\n{context}\nQuestion: {question}"
+    counter = SimpleTokenCounter()
+
+    def _assemble(self, docs, question="what is covered", budget=1000):
+        used, _ = assemble_context(question, docs, self.template, counter=self.counter, budget=budget)
+        return [doc.page_content for doc in used]
+
+    def test_distance_cutoff_is_off_by_default(self):
+        docs = [_doc("a", score=0.1), _doc("b", score=9.0)]
+        self.assertEqual(drop_low_scores(docs), docs)
+
+    def test_distance_cutoff_keeps_lexical_hits(self):
+        docs = [
+            _doc("best", score=1.0, bm25_score=2.0),
+            _doc("near", score=1.5),
+            _doc("far", score=9.0),
+            _doc("exact id match", score=9.0, bm25_score=5.0),
+            _doc("bm25 only", bm25_score=1.0),
+        ]
+        kept = [doc.page_content for doc in drop_low_scores(docs, ratio=1.5)]
+        self.assertEqual(kept, ["best", "near", "exact id match", "bm25 only"])
+
+    def test_stops_at_the_token_budget(self):
+        docs = [_doc(f"Sentence number {i} is here.") for i in range(10)]
+        tokens = self.counter.count([docs[0].page_content])[0]
+        self.assertEqual(len(self._assemble(docs, budget=tokens * 3)), 3)
+        # A single sentence over budget is truncated, never sent empty
+        huge = [_doc(" ".join(["word"] * 500) + ".")]
+        kept = self._assemble(huge, budget=50)
+        self.assertEqual(len(kept), 1)
+        self.assertLessEqual(self.counter.count(kept)[0], 50)
+
+    def test_sentences_repeated_across_overlapping_chunks_are_sent_once(self):
+        docs = [
+            _doc("First point. Shared overlap sentence."),
+            _doc("Shared overlap sentence. Second point."),
+            _doc("First point."),
+        ]
+        self.assertEqual(
+            self._assemble(docs),
+            ["First point. Shared overlap sentence.", "Second point."],
+        )
+
+    @override_settings(RAG_CONTEXT_EXTRACT_SENTENCES=True, RAG_CONTEXT_SENTENCES_PER_CHUNK=1)
+    def test_sentence_extraction_keeps_question_terms(self):
+        docs = [_doc("Unrelated opening. The syllabus covers compilers. Another aside.")]
+        self.assertEqual(self._assemble(docs, question="what does the syllabus cover"),
+                         ["The syllabus covers compilers."])
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='password123')
+        Document.objects.create(user=cls.user, file='documents/a.pdf', processed=True,
+                                status=Document.STATUS_COMPLETED)
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        patcher = mock.patch.object(async_views, 'authenticate', mock.AsyncMock(return_value=self.user))
+        self.authenticate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _ask(self, body):
+        request = self.factory.post('/api/rag/async/ask/', body, content_type='application/json')
+        return async_to_sync(async_views.ask_question)(request)
+
+    def test_json_body_must_be_an_object(self):
+        for body in ('[]', '"x"', '1', '{'):
+            self.assertEqual(self._ask(body).status_code, 400, body)
+
+    def test_answer_is_returned_and_saved(self):
+        with mock.patch.object(async_views, 'process_user_question', mock.AsyncMock(return_value='42')):
+            response = self._ask('{"question": "meaning?"}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(QueryHistory.objects.get(user=self.user).answer, '42')
+
+    def test_full_llm_queue_is_429_with_retry_after(self):
+        error = AdmissionRejected('LLM service', 3, 'queue full')
+        with mock.patch.object(async_views, 'process_user_question', mock.AsyncMock(side_effect=error)):
+            response = self._ask('{"question": "meaning?"}')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_unauthenticated_requests_are_401(self):
+        self.authenticate.return_value = None
+        self.assertEqual(self._ask('{"question": "meaning?"}').status_code, 401)
+
+    def test_upload_rejects_non_pdf(self):
+        request = self.factory.post('/api/rag/async/documents/', {'file': SimpleUploadedFile('a.txt', b'x')})
+        response = async_to_sync(async_views.upload_document)(request)
+        self.assertEqual(response.status_code, 400)
+
+    def test_process_user_question_uses_the_shared_steps(self):
+        class Chain:
+            async def acall(self, inputs, return_only_outputs=True):
+                return {'output_text': f"{len(inputs['input_documents'])} docs for {inputs['question']}"}
+
+        docs = [_doc("context")]
+        with mock.patch.object(async_views, 'retrieve_context', return_value=(None, docs, None, None)), \
+                mock.patch('rag_app.views.get_conversational_chain', return_value=Chain()), \
+                mock.patch('rag_app.views.health.check_llm_available'):
+            answer = async_to_sync(async_views.process_user_question)(self.user, 'why?')
+        self.assertEqual(answer, "1 docs for why?")
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    def __init__(self):
+        super().__init__(dim=64)
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+class ShardTestCase(TestCase):
+    """Per-test index directory and hashing embeddings in place of the model."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(FAISS_INDEX_PATH=directory.name, RAG_QUERY_BATCH_SIZE=1)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.embeddings = CountingEmbeddings()
+        patcher = mock.patch.object(embeddings, '_embeddings', self.embeddings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        vector_store.index_cache.clear()
+        self.addCleanup(vector_store.index_cache.clear)
+        self.user = User.objects.create_user(username='owner')
+
+    def add_document(self, count, offset=0):
+        document = Document.objects.create(user=self.user, file='documents/a.pdf')
+        DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=document, chunk_index=i,
+                          chunk_text=f"{WORDS[(offset + i) % len(WORDS)]} code{offset + i} notes")
+            for i in range(count)
+        ])
+        chunks = DocumentChunk.objects.filter(document=document)
+        vector_store.add_chunks(self.user, chunks)
+        return list(chunks.order_by('chunk_index').values_list('pk', flat=True))
+
+    def load(self):
+        return ChunkIndex.load(vector_store.get_index_path(self.user))
+
+    def search_ids(self, question, k=4):
+        return [doc.metadata['chunk_id'] for doc in vector_store.similarity_search(self.user, question, k=k)]
+
+
+class ChunkIndexUpdateTests(ShardTestCase):
+    def test_incremental_add_embeds_only_new_chunks(self):
+        first = self.add_document(5)
+        self.assertEqual(self.embeddings.embedded, 5)
+        second = self.add_document(5, offset=5)
+        self.assertEqual(self.embeddings.embedded, 10)
+        self.assertEqual(self.load().live_count, 10)
+        self.assertEqual(self.search_ids("code7", k=1), [second[2]])
+        self.assertEqual(self.search_ids("code1", k=1), [first[1]])
+
+    def test_deletes_are_tombstoned_then_compacted(self):
+        ids = self.add_document(10)
+        vector_store.remove_chunks(self.user, ids[:1])
+        chunk_index = self.load()
+        self.assertEqual((chunk_index.tombstones, chunk_index.index.ntotal), ({ids[0]}, 10))
+        self.assertNotIn(ids[0], self.search_ids("code0", k=10))
+
+        # Past RAG_INDEX_TOMBSTONE_RATIO the vectors are removed for real
+        vector_store.remove_chunks(self.user, ids[1:3])
+        chunk_index = self.load()
+        self.assertEqual((chunk_index.tombstones, chunk_index.index.ntotal), (set(), 7))
+        self.assertEqual(sorted(self.search_ids("notes", k=10)), sorted(ids[3:]))
+
+    def test_ids_never_indexed_are_not_tombstoned(self):
+        ids = self.add_document(10)
+        vector_store.remove_chunks(self.user, [max(ids) + 1, max(ids) + 2])
+        chunk_index = self.load()
+        self.assertEqual((chunk_index.tombstones, chunk_index.live_count), (set(), 10))
+
+    @override_settings(RAG_INDEX_HNSW_MIN_VECTORS=4)
+    def test_hnsw_shard_is_rebuilt_instead_of_compacted(self):
+        ids = self.add_document(10)
+        self.assertEqual(self.load().kind, 'hnsw')
+        # Phantom ids must not count towards the shard being empty
+        vector_store.remove_chunks(self.user, [max(ids) + i for i in range(1, 20)])
+        self.assertEqual(self.load().live_count, 10)
+
+        embedded = self.embeddings.embedded
+        DocumentChunk.objects.filter(pk__in=ids[:3]).delete()
+        vector_store.remove_chunks(self.user, ids[:3])
+        chunk_index = self.load()
+        self.assertEqual((chunk_index.kind, chunk_index.tombstones, chunk_index.index.ntotal), ('hnsw', set(), 7))
+        # The rebuild reuses stored vectors
+        self.assertEqual(self.embeddings.embedded, embedded)
+
+
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader')
+        QueryHistory.objects.bulk_create([
+            QueryHistory(user=cls.user, question=f"q{i}", answer="a" * (i + 1)) for i in range(5)
+        ])
+        # Several rows sharing one timestamp exercise the id tie-break
+        QueryHistory.objects.filter(user=cls.user).update(created_at=timezone.now())
+        cls.history = sorted(QueryHistory.objects.filter(user=cls.user).values_list('pk', flat=True), reverse=True)
+        Document.objects.bulk_create([
+            Document(user=cls.user, file=f'documents/{i}.pdf') for i in range(3)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, **params):
+        ids, cursor = [], None
+        while True:
+            query = dict(params, **({'cursor': cursor} if cursor else {}))
+            response = self.client.get(url, query)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_cursor_walks_equal_timestamps_without_gaps_or_repeats(self):
+        self.assertEqual(self.walk('/api/rag/history/', limit=2), self.history)
+        self.assertEqual(len(self.walk('/api/rag/documents/list/', limit=1)), 3)
+
+    def test_unpaginated_requests_get_the_full_list(self):
+        response = self.client.get('/api/rag/history/')
+        self.assertEqual([item['id'] for item in response.data], self.history)
+
+    def test_fields_projection(self):
+        response = self.client.get('/api/rag/history/', {'limit': 1, 'fields': 'question,bogus'})
+        self.assertEqual(set(response.data['results'][0]), {'question'})
+        response = self.client.get('/api/rag/documents/list/', {'limit': 1, 'fields': 'id,status'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'status'})
+
+    def test_answer_chars_truncates(self):
+        response = self.client.get('/api/rag/history/', {'limit': 5, 'answer_chars': 2})
+        answers = {item['question']: item for item in response.data['results']}
+        self.assertEqual((answers['q4']['answer'], answers['q4']['answer_truncated']), ('aa', True))
+        self.assertEqual((answers['q0']['answer'], answers['q0']['answer_truncated']), ('a', False))
+
+    def test_bad_parameters_are_rejected(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'limit': 'ten'}, {'limit': 1, 'answer_chars': '0'},
+                       {'limit': 1, 'fields': 'bogus'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/rag/history/', params).status_code, 400)
+        response = self.client.get('/api/rag/documents/list/', {'cursor': 'e30'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AnswerCacheTests(ShardTestCase):
+    def setUp(self):
+        super().setUp()
+        caches[settings.RAG_ANSWER_CACHE_ALIAS].clear()
+        self.chain = mock.Mock(side_effect=lambda inputs, **kwargs: {"output_text": f"answer {self.chain.call_count}"})
+        patcher = mock.patch.object(views, 'prepare_llm_call', side_effect=lambda docs, question, llm=None: (self.chain, {}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ids = self.add_document(5)
+
+    def ask(self, question):
+        return views.process_user_question(self.user, question)
+
+    def test_normalised_repeats_hit(self):
+        self.assertEqual(self.ask("What is code1?"), "answer 1")
+        self.assertEqual(self.ask("  what IS   code1 "), "answer 1")
+        self.assertEqual(self.chain.call_count, 1)
+
+    def test_uploads_and_deletes_invalidate_answers(self):
+        self.assertEqual(self.ask("What is code1?"), "answer 1")
+        self.add_document(2, offset=5)
+        self.assertEqual(self.ask("What is code1?"), "answer 2")
+        vector_store.remove_chunks(self.user, self.ids[:1])
+        self.assertEqual(self.ask("What is code1?"), "answer 3")
+        self.assertEqual(self.ask("What is code1?"), "answer 3")
+
+    def test_near_duplicates_miss_by_default(self):
+        self.ask("what is code1 in the notes")
+        self.assertEqual(self.ask("what is code1 in these notes"), "answer 2")
+
+    def test_near_duplicates_respect_the_threshold(self):
+        first, second = "what is code1 in the notes", "what is code1 in these notes"
+        similarity = float(np.dot(self.embeddings.embed_query(first), self.embeddings.embed_query(second)))
+        self.assertLess(similarity, 0.99)
+        with override_settings(RAG_ANSWER_CACHE_SIMILARITY=0.99):
+            self.ask(first)
+            self.assertEqual(self.ask(second), "answer 2")
+        caches[settings.RAG_ANSWER_CACHE_ALIAS].clear()
+        with override_settings(RAG_ANSWER_CACHE_SIMILARITY=similarity - 0.01):
+            self.assertEqual(self.ask(first), "answer 3")
+            self.assertEqual(self.ask(second), "answer 3")
+
+
+class StoredVectorTests(ShardTestCase):
+    def test_rebuild_reuses_stored_float16_vectors(self):
+        ids = self.add_document(6)
+        self.assertEqual(set(DocumentChunk.objects.values_list('embedding_dtype', flat=True)), {'float16'})
+        with mock.patch.object(self.embeddings, 'embed_documents') as embed:
+            vector_store.rebuild_index(self.user)
+        embed.assert_not_called()
+        self.assertEqual(self.load().live_count, 6)
+        self.assertEqual(self.search_ids("code4", k=1), [ids[4]])
+
+    def test_model_change_marks_the_shard_stale_and_reembeds(self):
+        ids = self.add_document(6)
+        with override_settings(RAG_EMBEDDING_MODEL_VERSION='2'):
+            self.assertTrue(self.load().is_stale)
+            self.assertEqual(self.search_ids("code4", k=1), [ids[4]])
+            self.assertEqual(self.embeddings.embedded, 12)
+            self.assertFalse(self.load().is_stale)
+            models = set(DocumentChunk.objects.values_list('embedding_model', flat=True))
+            self.assertEqual(models, {embeddings.embedding_model_id()})
+
+
+@override_settings(RAG_INGESTION_MODE='worker')
+class IngestionTests(ShardTestCase):
+    TEXT = "Keyset pagination seeks on an index. " * 40
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # PDF parsing is covered by pdf_pages; feed the pipeline plain text
+        patcher = mock.patch.object(ingestion, 'get_pdf_text', return_value=self.TEXT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pending(self, name):
+        return Document.objects.create(user=self.user, file=f'documents/{name}.pdf')
+
+    def test_claims_oldest_pending_document_once(self):
+        first, second = self.pending('a'), self.pending('b')
+        self.assertEqual(ingestion.claim_next_document().pk, first.pk)
+        self.assertEqual(ingestion.claim_next_document().pk, second.pk)
+        self.assertIsNone(ingestion.claim_next_document())
+        statuses = set(Document.objects.values_list('status', flat=True))
+        self.assertEqual(statuses, {Document.STATUS_PROCESSING})
+
+    def test_requeues_only_stale_processing_documents(self):
+        stale, fresh = self.pending('a'), self.pending('b')
+        Document.objects.update(status=Document.STATUS_PROCESSING)
+        Document.objects.filter(pk=stale.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=settings.RAG_INGESTION_STALE_SECONDS + 1)
+        )
+        self.assertEqual(ingestion.requeue_stale_documents(), 1)
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stale.status, fresh.status), (Document.STATUS_PENDING, Document.STATUS_PROCESSING))
+
+    def test_upload_is_accepted_then_reports_status(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/rag/documents/', {'file': SimpleUploadedFile('notes.pdf', b'%PDF-1.4')})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], Document.STATUS_PENDING)
+        url = f"/api/rag/documents/{response.data['job_id']}/status/"
+
+        self.assertEqual(ingestion.process_pending(), 1)
+        response = client.get(url)
+        self.assertEqual((response.data['status'], response.data['progress']), (Document.STATUS_COMPLETED, 100))
+        self.assertGreater(self.load().live_count, 0)
+
+    def test_failure_is_recorded_even_if_cleanup_fails(self):
+        document = self.pending('a')
+        with mock.patch.object(vector_store, 'add_chunks', side_effect=RuntimeError("index is full")), \
+                mock.patch.object(vector_store, 'remove_chunks', side_effect=RuntimeError("disk gone")), \
+                self.assertLogs('rag_app.ingestion', 'ERROR'):
+            self.assertEqual(ingestion.process_pending(), 1)
+        document.refresh_from_db()
+        self.assertEqual(document.status, Document.STATUS_FAILED)
+        self.assertEqual(document.error, "Failed to process PDF: index is full")
+
+
+class ChunkIndexSearchTests(SimpleTestCase):
+    def setUp(self):
+        vectors = np.eye(8, 8, dtype='float32')[np.arange(100) % 8] + np.arange(100, dtype='float32')[:, None] / 100
+        self.chunk_index = ChunkIndex.create(8, 100)
+        self.chunk_index.add(np.arange(1, 101), vectors)
+        self.query = vectors[0]
+        self.nearest = [chunk_id for chunk_id, _ in self.chunk_index.search(self.query, k=100)]
+
+    def fetches(self, k):
+        calls = []
+        search = self.chunk_index.index.search
+
+        def spy(query, fetch, **kwargs):
+            calls.append(fetch)
+            return search(query, fetch, **kwargs)
+
+        with mock.patch.object(self.chunk_index, 'index', mock.Mock(wraps=self.chunk_index.index, ntotal=100)):
+            self.chunk_index.index.search.side_effect = spy
+            results = self.chunk_index.search(self.query, k=k)
+        return [chunk_id for chunk_id, _ in results], calls
+
+    def test_over_fetch_is_bounded(self):
+        self.chunk_index.tombstones = set(self.nearest[50:])
+        ids, calls = self.fetches(2)
+        self.assertEqual(ids, self.nearest[:2])
+        self.assertEqual(calls, [8])
+
+    def test_widens_when_tombstones_hide_the_nearest(self):
+        self.chunk_index.tombstones = set(self.nearest[:30])
+        ids, calls = self.fetches(2)
+        self.assertEqual(ids, self.nearest[30:32])
+        self.assertEqual(calls, [8, 32])
+
+    def test_returns_what_is_left_when_the_index_runs_out(self):
+        self.chunk_index.tombstones = set(self.nearest[:99])
+        ids, calls = self.fetches(3)
+        self.assertEqual(ids, self.nearest[99:])
+        self.assertEqual(calls, [12, 48, 100])
+
+
+class MetricsEndpointTests(TestCase):
+    URL = '/api/rag/metrics/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='ops', is_staff=True)
+        cls.student = User.objects.create_user(username='student')
+
+    def bearer(self, user):
+        return f"Bearer {RefreshToken.for_user(user).access_token}"
+
+    def test_closed_by_default(self):
+        self.assertEqual(self.client.get(self.URL).status_code, 401)
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(self.URL).status_code, 401)
+        self.assertEqual(self.client.get(self.URL, HTTP_AUTHORIZATION='Bearer junk').status_code, 401)
+
+    def test_staff_may_read(self):
+        response = self.client.get(self.URL, HTTP_AUTHORIZATION=self.bearer(self.staff))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.URL, HTTP_AUTHORIZATION=self.bearer(self.student)).status_code, 401)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(self.URL).status_code, 200)
+
+    @override_settings(RAG_METRICS_TOKEN='s3cret')
+    def test_scrape_token(self):
+        self.assertEqual(self.client.get(self.URL, HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self.client.get(self.URL, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+    @override_settings(RAG_METRICS_PUBLIC=True)
+    def test_public_when_enabled(self):
+        self.assertEqual(self.client.get(self.URL).status_code, 200)
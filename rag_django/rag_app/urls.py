@@ -1,15 +1,22 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     # Document management
     path('documents/', views.upload_document, name='upload_document'),
     path('documents/list/', views.get_documents, name='get_documents'),
+    path('documents/<int:document_id>/status/', views.document_status, name='document_status'),
     path('documents/<int:document_id>/delete/', views.delete_document, name='delete_document'),
     
     # RAG functionality
     path('ask/', views.ask_question, name='ask_question'),
+    path('ask/stream/', views.ask_question_stream, name='ask_question_stream'),
     path('history/', views.get_query_history, name='get_query_history'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
+    
+    # Async versions of the above, for ASGI deployments
+    path('async/ask/', async_views.ask_question, name='ask_question_async'),
+    path('async/documents/', async_views.upload_document, name='upload_document_async'),
     
     # Student registration and management
     path('register/', views.student_register, name='student_register'),
@@ -0,0 +1,737 @@
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+import faiss
+import numpy as np
+from django.conf import settings
+from langchain.docstore.document import Document as LCDocument
+
+from . import metrics
+from .embeddings import decode_vector, embed_documents, embed_query, embedding_model_id, encode_vector
+from .lexical import LexicalIndex, reciprocal_rank_fusion
+from .models import DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "chunks.faiss"
+LEXICAL_FILE = "lexical.sqlite3"
+# BM25 postings were a JSON document before they moved to SQLite
+LEGACY_LEXICAL_FILE = "lexical.json"
+META_FILE = "meta.json"
+
+INDEX_FLAT = "flat"
+INDEX_HNSW = "hnsw"
+INDEX_IVFPQ = "ivfpq"
+IVFPQ_MIN_TRAINING_POINTS = 10000
+
+# Tombstone over-fetch per search pass, as a multiple of k
+SEARCH_OVERFETCH = 4
+
+# Read-only, memory-mapped loading: vector codes stay in the page cache,
+# shared by every worker process instead of copied into each one.
+# IO_FLAG_MMAP maps IVF inverted lists; IO_FLAG_MMAP_IFC maps flat and
+# HNSW codes but only exists in newer FAISS releases, and it makes IVF
+# reads fail, so the flags depend on the shard's kind.
+MMAP_FLAT_CODES = hasattr(faiss, 'IO_FLAG_MMAP_IFC')
+_MMAP_CODES_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0) | faiss.IO_FLAG_READ_ONLY
+MMAP_FLAGS = {
+    INDEX_FLAT: _MMAP_CODES_FLAGS,
+    INDEX_HNSW: _MMAP_CODES_FLAGS,
+    INDEX_IVFPQ: faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+}
+
+# One lock per shard so uploads from different users never wait on each other
+_shard_locks = {}
+_shard_locks_guard = threading.Lock()
+
+
+def choose_index_kind(count):
+    """Exact search for small shards, graph or quantised ANN as they grow."""
+    # PQ training needs a few thousand points however low the setting is
+    if count >= max(settings.RAG_INDEX_IVFPQ_MIN_VECTORS, IVFPQ_MIN_TRAINING_POINTS):
+        return INDEX_IVFPQ
+    if count >= settings.RAG_INDEX_HNSW_MIN_VECTORS:
+        return INDEX_HNSW
+    return INDEX_FLAT
+
+
+def _pq_subquantizers(dim):
+    """Largest common PQ code size that divides dim with >= 4 dims per code."""
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
+
+
+def build_faiss_index(kind, dim, count, hnsw_m=None, nlist=None):
+    """Create an empty FAISS index of the given kind that takes chunk ids."""
+    if kind == INDEX_HNSW:
+        description = f"HNSW{hnsw_m or settings.RAG_INDEX_HNSW_M},Flat"
+    elif kind == INDEX_IVFPQ:
+        if nlist is None:
+            # ~4*sqrt(n) lists, keeping >= 39 training points per centroid
+            nlist = int(4 * math.sqrt(count))
+            nlist = max(1, min(nlist, min(count, settings.RAG_INDEX_TRAIN_SAMPLE) // 39))
+        description = f"IVF{nlist},PQ{_pq_subquantizers(dim)}"
+    else:
+        description = "Flat"
+    index = faiss.index_factory(dim, description)
+    if kind == INDEX_IVFPQ:
+        # IVF stores ids in its inverted lists and removes them in place;
+        # an IndexIDMap around it would renumber on remove_ids and leave
+        # the lists returning the wrong ids
+        return index
+    # IndexIDMap, not IndexIDMap2: we never reconstruct by id, and IDMap2's
+    # reverse hash map would be rebuilt in full on every load
+    return faiss.IndexIDMap(index)
+
+
+class ChunkIndex:
+    """
+    FAISS index whose ids are DocumentChunk primary keys, with a BM25
+    index over the same chunks' texts for hybrid search.
+
+    Deleted chunks are only tombstoned; they are filtered out of search
+    results and physically removed once they exceed the compaction ratio.
+    Indexes loaded with mmap=True are read-only and only used for search.
+    """
+
+    def __init__(self, index, tombstones=None, version=0, model=None, kind=INDEX_FLAT, mmapped=False,
+                 lexical=None):
+        self.index = index
+        self.lexical = lexical
+        self.tombstones = set(tombstones or ())
+        self.version = version
+        self.model = model or embedding_model_id()
+        self.kind = kind
+        self.mmapped = mmapped
+
+    @classmethod
+    def create(cls, dim, count=0):
+        """New empty index, of the kind suited to holding `count` vectors."""
+        kind = choose_index_kind(count)
+        return cls(build_faiss_index(kind, dim, count), kind=kind, lexical=_new_lexical_index())
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """
+        Load an index from disk, or return None if there is none. With
+        mmap=True the file is mapped read-only rather than copied into
+        memory, so loading costs about the same whatever the shard size.
+        The BM25 postings are opened, not read; queries fetch their terms.
+        """
+        index_file = os.path.join(path, INDEX_FILE)
+        meta_file = os.path.join(path, META_FILE)
+        if not (os.path.exists(index_file) and os.path.exists(meta_file)):
+            return None
+        with open(meta_file) as f:
+            meta = json.load(f)
+        index = None
+        kind = meta.get('kind', INDEX_FLAT)
+        if mmap:
+            try:
+                index = faiss.read_index(index_file, MMAP_FLAGS[kind])
+            except RuntimeError as e:
+                logger.warning("Could not memory-map %s, loading a copy: %s", index_file, e)
+                mmap = False
+        if index is None:
+            index = faiss.read_index(index_file)
+        lexical = None
+        lexical_file = os.path.join(path, LEXICAL_FILE)
+        # Shards saved before hybrid search, or with JSON postings, have
+        # none yet and are rebuilt on first use
+        if os.path.exists(lexical_file):
+            lexical = LexicalIndex(lexical_file, read_only=mmap)
+        return cls(
+            index,
+            tombstones=meta.get('tombstones', []),
+            version=meta.get('version', 0),
+            model=meta.get('model'),
+            kind=kind,
+            mmapped=mmap,
+            lexical=lexical,
+        )
+
+    def save(self, path):
+        """
+        Write the index and its metadata atomically. Processes that still
+        have the old file mapped keep reading it until they reload. BM25
+        postings of a loaded shard are committed in place, so readers may
+        see new chunks' terms just before their vectors.
+        """
+        os.makedirs(path, exist_ok=True)
+        # Monotonic across rebuilds too, so caches keyed on the version
+        # never see a number reused for different contents
+        self.version = max(self.version + 1, time.time_ns())
+        index_file = os.path.join(path, INDEX_FILE)
+        meta_file = os.path.join(path, META_FILE)
+        lexical_file = os.path.join(path, LEXICAL_FILE)
+        faiss.write_index(self.index, index_file + ".tmp")
+        with open(meta_file + ".tmp", "w") as f:
+            json.dump({
+                'dim': self.index.d,
+                'model': self.model,
+                'kind': self.kind,
+                'tombstones': sorted(self.tombstones),
+                'version': self.version,
+            }, f)
+        os.replace(index_file + ".tmp", index_file)
+        if self.lexical is not None:
+            # Written in place when loaded from this shard: only the
+            # changed postings are written, not the whole index
+            self.lexical.save(lexical_file)
+        legacy_file = os.path.join(path, LEGACY_LEXICAL_FILE)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+        os.replace(meta_file + ".tmp", meta_file)
+
+    @property
+    def nbytes(self):
+        """
+        Approximate private memory: stored codes plus int64 ids. Codes of
+        a memory-mapped index live in the shared page cache and don't count.
+        """
+        inner = self._inner_index
+        if self.kind == INDEX_IVFPQ:
+            code_size = 0 if self.mmapped else inner.code_size
+        elif self.kind == INDEX_HNSW:
+            # Flat vectors plus the graph links, which are always read in
+            code_size = inner.hnsw.nb_neighbors(0) * 4
+            if not (self.mmapped and MMAP_FLAT_CODES):
+                code_size += self.index.d * 4
+        else:
+            code_size = 0 if self.mmapped and MMAP_FLAT_CODES else self.index.d * 4
+        lexical_bytes = self.lexical.nbytes if self.lexical is not None else 0
+        return self.index.ntotal * (code_size + 8) + lexical_bytes
+
+    @property
+    def _inner_index(self):
+        if isinstance(self.index, faiss.IndexIDMap):
+            return faiss.downcast_index(self.index.index)
+        return faiss.downcast_index(self.index)
+
+    @property
+    def removes_in_place(self):
+        """
+        False for HNSW graphs, which cannot drop vectors, and for IVF-PQ
+        shards saved inside an IndexIDMap, whose remove_ids corrupts ids.
+        Those are rebuilt instead of compacted.
+        """
+        if self.kind == INDEX_HNSW:
+            return False
+        return not (self.kind == INDEX_IVFPQ and isinstance(self.index, faiss.IndexIDMap))
+
+    @property
+    def needs_training(self):
+        return not self.index.is_trained
+
+    @property
+    def needs_rebuild(self):
+        """
+        True once the shard has outgrown (or shrunk below) its index kind,
+        or has tombstones it cannot remove in place.
+        """
+        order = [INDEX_FLAT, INDEX_HNSW, INDEX_IVFPQ]
+        current = order.index(self.kind)
+        if order.index(choose_index_kind(self.live_count)) > current:
+            return True
+        # Only step down well below the threshold, so a shard hovering
+        # around it is not rebuilt on every upload and delete
+        if order.index(choose_index_kind(self.live_count * 2)) < current:
+            return True
+        return not self.removes_in_place and self._over_tombstone_ratio()
+
+    def train(self, vectors):
+        self.index.train(np.asarray(vectors, dtype='float32'))
+
+    @property
+    def is_stale(self):
+        """True when the index was built with a different embedding model."""
+        return self.model != embedding_model_id()
+
+    @property
+    def live_count(self):
+        return self.index.ntotal - len(self.tombstones)
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype='int64')
+        vectors = np.asarray(vectors, dtype='float32')
+        self.index.add_with_ids(vectors, ids)
+
+    def add_texts(self, ids, texts):
+        for chunk_id, text in zip(ids, texts):
+            self.lexical.add(chunk_id, text)
+
+    def _over_tombstone_ratio(self):
+        return bool(self.index.ntotal) and len(self.tombstones) / self.index.ntotal >= _tombstone_ratio()
+
+    def stored_ids(self):
+        """Ids of every vector in the FAISS index, tombstoned or not."""
+        if isinstance(self.index, faiss.IndexIDMap):
+            return faiss.vector_to_array(self.index.id_map)
+        ivf = faiss.extract_index_ivf(self.index)
+        invlists = ivf.invlists
+        return np.concatenate([np.empty(0, dtype='int64')] + [
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(ivf.nlist) if invlists.list_size(list_no)
+        ])
+
+    def remove(self, ids):
+        ids = [int(i) for i in ids]
+        if self.lexical is not None:
+            self.lexical.remove(ids)
+        # Ingestion failures discard chunks that never reached the index;
+        # tombstoning those would skew live_count and hide reused pks
+        ids = set(ids).intersection(self.stored_ids().tolist())
+        self.tombstones.update(ids)
+        # Shards that cannot drop vectors are rebuilt instead (needs_rebuild)
+        if self.removes_in_place and self._over_tombstone_ratio():
+            self.compact()
+
+    def compact(self):
+        """Physically remove all tombstoned ids from the index."""
+        if self.tombstones:
+            self.index.remove_ids(np.array(sorted(self.tombstones), dtype='int64'))
+            self.tombstones.clear()
+
+    def search_params(self, nprobe=None, ef_search=None):
+        """Per-query accuracy/speed knobs for ANN kinds (None for flat)."""
+        if self.kind == INDEX_IVFPQ:
+            return faiss.SearchParametersIVF(nprobe=nprobe or settings.RAG_INDEX_NPROBE)
+        if self.kind == INDEX_HNSW:
+            return faiss.SearchParametersHNSW(efSearch=ef_search or settings.RAG_INDEX_EF_SEARCH)
+        return None
+
+    def search(self, vector, k=4, nprobe=None, ef_search=None):
+        """Return up to k (chunk_id, distance) pairs, nearest first."""
+        if self.live_count <= 0:
+            return []
+        # Over-fetch to skip tombstoned ids, but by a bounded factor: a shard
+        # with many tombstones would otherwise pull most of its vectors for
+        # every query. Widen and retry only when the first pass comes up short.
+        fetch = min(k + min(len(self.tombstones), k * (SEARCH_OVERFETCH - 1)), self.index.ntotal)
+        query = np.asarray([vector], dtype='float32')
+        params = self.search_params(nprobe, ef_search)
+        while True:
+            if params is None:
+                distances, ids = self.index.search(query, fetch)
+            else:
+                distances, ids = self.index.search(query, fetch, params=params)
+            results = []
+            found = 0
+            for chunk_id, distance in zip(ids[0].tolist(), distances[0].tolist()):
+                if chunk_id == -1:
+                    continue
+                found += 1
+                if chunk_id in self.tombstones:
+                    continue
+                results.append((chunk_id, distance))
+                if len(results) == k:
+                    return results
+            # Fewer ids than asked for means the index has nothing further
+            if found < fetch or fetch == self.index.ntotal:
+                return results
+            fetch = min(fetch * SEARCH_OVERFETCH, self.index.ntotal)
+
+    def hybrid_search(self, vector, text, k=4, candidates=None):
+        """
+        Fuse the nearest vectors and the best BM25 matches for the text
+        with reciprocal rank fusion. Returns up to k
+        (chunk_id, fused_score, distance, bm25_score) tuples, best first;
+        distance or bm25_score is None when only one side found the chunk.
+        """
+        candidates = max(k, candidates or settings.RAG_HYBRID_CANDIDATES)
+        vector_hits = self.search(vector, k=candidates)
+        lexical_hits = self.lexical.search(text, k=candidates) if self.lexical is not None else []
+        distances, bm25_scores = dict(vector_hits), dict(lexical_hits)
+        fused = reciprocal_rank_fusion([vector_hits, lexical_hits], k=settings.RAG_RRF_K)
+        return [
+            (chunk_id, score, distances.get(chunk_id), bm25_scores.get(chunk_id))
+            for chunk_id, score in fused[:k]
+        ]
+
+
+def _tombstone_ratio():
+    return getattr(settings, 'RAG_INDEX_TOMBSTONE_RATIO', 0.2)
+
+
+def _new_lexical_index():
+    return LexicalIndex()
+
+
+def _index_stamp(path):
+    """
+    Identify the on-disk version of a shard. save() replaces meta.json
+    last, so its inode and mtime change on every upload and delete.
+    """
+    try:
+        st = os.stat(os.path.join(path, META_FILE))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class IndexCache:
+    """
+    Per-process LRU of loaded shards, bounded by approximate memory use.
+    Entries are revalidated against the shard's file stamp on every get,
+    so writes from other worker processes are picked up. With mmap on,
+    shards are mapped read-only and their pages shared between processes.
+    """
+
+    def __init__(self, max_bytes, mmap=True):
+        self.max_bytes = max_bytes
+        self.mmap = mmap
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        stamp = _index_stamp(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if stamp is None:
+                self._entries.pop(path, None)
+                return None
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        with metrics.span('index_load'):
+            chunk_index = ChunkIndex.load(path, mmap=self.mmap)
+        if chunk_index is not None:
+            self.put(path, chunk_index, stamp)
+        return chunk_index
+
+    def put(self, path, chunk_index, stamp=None):
+        stamp = stamp or _index_stamp(path)
+        with self._lock:
+            self._entries[path] = (stamp, chunk_index)
+            self._entries.move_to_end(path)
+            self._evict()
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def nbytes(self):
+        return sum(entry[1].nbytes for entry in self._entries.values())
+
+    def _evict(self):
+        # Always keep the most recently used shard, even if it alone is over budget
+        while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'shards': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'mmap': self.mmap,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+index_cache = IndexCache(
+    getattr(settings, 'RAG_INDEX_CACHE_BYTES', 512 * 1024 * 1024),
+    mmap=getattr(settings, 'RAG_INDEX_MMAP', True),
+)
+
+
+def _collect_metrics():
+    stats = index_cache.stats()
+    return [
+        ('rag_index_cache_shards', 'gauge', "Index shards held in the cache.", stats['shards']),
+        ('rag_index_cache_bytes', 'gauge', "Approximate memory held by cached shards.", stats['bytes']),
+        ('rag_index_cache_hits_total', 'counter', "Index cache hits.", stats['hits']),
+        ('rag_index_cache_misses_total', 'counter', "Index cache misses.", stats['misses']),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def get_shard_key(user):
+    """Each user gets their own index shard."""
+    return f"user_{user.pk}"
+
+
+def get_index_path(user):
+    return os.path.join(str(settings.FAISS_INDEX_PATH), get_shard_key(user))
+
+
+@contextmanager
+def shard_lock(user):
+    """
+    Serialise read-modify-write cycles on one shard, across threads and,
+    where flock is available, across worker processes.
+    """
+    shard = get_shard_key(user)
+    with _shard_locks_guard:
+        lock = _shard_locks.setdefault(shard, threading.Lock())
+    with lock:
+        lock_dir = os.path.join(str(settings.FAISS_INDEX_PATH), ".locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"{shard}.lock"), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def index_exists(user):
+    return _index_stamp(get_index_path(user)) is not None
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _store_embeddings(chunk_ids, vectors):
+    model_id = embedding_model_id()
+    updates = []
+    for chunk_id, vector in zip(chunk_ids, vectors):
+        data, dtype = encode_vector(vector)
+        updates.append(DocumentChunk(
+            pk=chunk_id, embedding=data, embedding_dtype=dtype, embedding_model=model_id
+        ))
+    DocumentChunk.objects.bulk_update(
+        updates, ['embedding', 'embedding_dtype', 'embedding_model'],
+        batch_size=settings.RAG_CHUNK_BATCH_SIZE,
+    )
+
+
+def _embed_missing(chunks):
+    """
+    Embed the chunks in the queryset that have no vector for the current
+    model and store those vectors.
+    """
+    model_id = embedding_model_id()
+    # Collect ids up front: the rows are updated while we work through them
+    missing_ids = list(chunks.exclude(embedding_model=model_id).values_list('pk', flat=True))
+    for batch_ids in _batched(missing_ids, settings.RAG_CHUNK_BATCH_SIZE):
+        pairs = list(DocumentChunk.objects.filter(pk__in=batch_ids).values_list('pk', 'chunk_text'))
+        if pairs:
+            vectors = embed_documents([text for _, text in pairs])
+            _store_embeddings([pk for pk, _ in pairs], vectors)
+
+
+def _iter_stored_vectors(chunks):
+    """Yield (ids, vectors) batches of the stored current-model vectors."""
+    batch_size = settings.RAG_CHUNK_BATCH_SIZE
+    stored = chunks.filter(embedding_model=embedding_model_id()).values_list(
+        'pk', 'embedding', 'embedding_dtype'
+    ).iterator(chunk_size=batch_size)
+    for batch in _batched(stored, batch_size):
+        yield [pk for pk, _, _ in batch], [decode_vector(data, dtype) for _, data, dtype in batch]
+
+
+def _sample_vectors(chunks, size):
+    """Uniform random sample of stored vectors, for training ANN indexes."""
+    ids = list(chunks.filter(embedding_model=embedding_model_id()).values_list('pk', flat=True))
+    if len(ids) > size:
+        ids = random.sample(ids, size)
+    vectors = []
+    for batch_ids in _batched(ids, settings.RAG_CHUNK_BATCH_SIZE):
+        for _, batch_vectors in _iter_stored_vectors(DocumentChunk.objects.filter(pk__in=batch_ids)):
+            vectors.extend(batch_vectors)
+    return vectors
+
+
+def _index_texts(chunk_index, chunks):
+    """Add the chunks' texts to the shard's BM25 index."""
+    texts = chunks.values_list('pk', 'chunk_text').iterator(chunk_size=settings.RAG_CHUNK_BATCH_SIZE)
+    for batch in _batched(texts, settings.RAG_CHUNK_BATCH_SIZE):
+        chunk_index.add_texts([pk for pk, _ in batch], [text for _, text in batch])
+
+
+def _index_chunks(chunk_index, chunks):
+    """
+    Add every chunk in the queryset to an existing index. Vectors stored
+    for the current model are reused as-is; only chunks without one are
+    embedded (and their vectors saved).
+    """
+    _embed_missing(chunks)
+    for ids, vectors in _iter_stored_vectors(chunks):
+        chunk_index.add(ids, vectors)
+    _index_texts(chunk_index, chunks.filter(embedding_model=embedding_model_id()))
+    return chunk_index
+
+
+def _rebuild_locked(user):
+    chunks = DocumentChunk.objects.filter(document__user=user)
+    _embed_missing(chunks)
+    chunks = chunks.filter(embedding_model=embedding_model_id())
+    count = chunks.count()
+    if not count:
+        _remove_locked(user)
+        return None
+    first = chunks.values_list('embedding', 'embedding_dtype').first()
+    chunk_index = ChunkIndex.create(len(decode_vector(*first)), count)
+    if chunk_index.needs_training:
+        chunk_index.train(_sample_vectors(chunks, settings.RAG_INDEX_TRAIN_SAMPLE))
+    for ids, vectors in _iter_stored_vectors(chunks):
+        chunk_index.add(ids, vectors)
+    _index_texts(chunk_index, chunks)
+    _save_locked(user, chunk_index)
+    return chunk_index
+
+
+def _save_locked(user, chunk_index):
+    path = get_index_path(user)
+    chunk_index.save(path)
+    if index_cache.mmap:
+        # Drop the writable copy; the next search maps the new file
+        index_cache.discard(path)
+    else:
+        index_cache.put(path, chunk_index)
+
+
+def _remove_locked(user):
+    path = get_index_path(user)
+    index_cache.discard(path)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def rebuild_index(user):
+    """
+    Rebuild the user's shard from scratch. Stored vectors are reused, so
+    only chunks embedded with another model are re-embedded.
+    """
+    with shard_lock(user):
+        return _rebuild_locked(user)
+
+
+def add_chunks(user, chunks):
+    """
+    Append the given DocumentChunk queryset to the user's shard, embedding
+    only what has no stored vector. Falls back to a full rebuild when no
+    shard exists yet or it was built with another embedding model.
+    """
+    path = get_index_path(user)
+    with shard_lock(user):
+        chunk_index = ChunkIndex.load(path)
+        if chunk_index is None or chunk_index.is_stale or chunk_index.lexical is None:
+            _rebuild_locked(user)
+            return
+        _index_chunks(chunk_index, chunks)
+        if chunk_index.needs_rebuild:
+            # Outgrew its index kind; rebuilding from stored vectors is cheap
+            _rebuild_locked(user)
+            return
+        _save_locked(user, chunk_index)
+
+
+def remove_chunks(user, chunk_ids):
+    """
+    Tombstone the given chunk ids, compacting (or, for shards that cannot
+    remove in place, rebuilding) once past the threshold.
+    """
+    chunk_ids = list(chunk_ids)
+    if not chunk_ids:
+        return
+    path = get_index_path(user)
+    with shard_lock(user):
+        chunk_index = ChunkIndex.load(path)
+        if chunk_index is None:
+            return
+        chunk_index.remove(chunk_ids)
+        if chunk_index.live_count <= 0:
+            _remove_locked(user)
+        elif chunk_index.needs_rebuild:
+            # The deleted chunks are already gone from the database
+            _rebuild_locked(user)
+        else:
+            _save_locked(user, chunk_index)
+
+
+def remove_index(user):
+    with shard_lock(user):
+        _remove_locked(user)
+
+
+def index_version(user):
+    """Version of the user's shard, or None if they have no index."""
+    chunk_index = index_cache.get(get_index_path(user))
+    return chunk_index.version if chunk_index is not None else None
+
+
+def similarity_search(user, question, k=None, query_vector=None):
+    """
+    Return the k chunks in the user's shard that best match the question
+    as LangChain documents, with chunk texts read from the database. With
+    RAG_HYBRID_SEARCH on, vector and BM25 rankings are fused; otherwise
+    only vector distance is used. Pass query_vector to reuse an embedding
+    the caller already computed.
+    """
+    k = k or settings.RAG_RETRIEVAL_K
+    hybrid = settings.RAG_HYBRID_SEARCH
+    chunk_index = index_cache.get(get_index_path(user))
+    if chunk_index is not None and (chunk_index.is_stale or (hybrid and chunk_index.lexical is None)):
+        chunk_index = rebuild_index(user)
+    if chunk_index is None:
+        raise Exception("Please process PDF documents first before asking questions.")
+    if query_vector is None:
+        query_vector = embed_query(question)
+    with metrics.span('vector_search'):
+        if hybrid:
+            hits = chunk_index.hybrid_search(query_vector, question, k=k)
+        else:
+            hits = [(chunk_id, None, distance, None) for chunk_id, distance in chunk_index.search(query_vector, k=k)]
+    with metrics.span('fetch_chunks'):
+        # Only the fields the documents need; the embedding blob is the bulk of each row
+        chunks = DocumentChunk.objects.only(
+            'id', 'document_id', 'chunk_index', 'chunk_text', 'page_start', 'page_end'
+        ).in_bulk([hit[0] for hit in hits])
+    docs = []
+    for chunk_id, fused_score, distance, bm25_score in hits:
+        chunk = chunks.get(chunk_id)
+        if chunk is None:
+            continue
+        docs.append(LCDocument(
+            page_content=chunk.chunk_text,
+            metadata={
+                'chunk_id': chunk_id,
+                'document_id': chunk.document_id,
+                'chunk_index': chunk.chunk_index,
+                'page_start': chunk.page_start,
+                'page_end': chunk.page_end,
+                'score': distance,
+                'bm25_score': bm25_score,
+                'fused_score': fused_score,
+            },
+        ))
+    return docs
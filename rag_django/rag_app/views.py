@@ -1,16 +1,10 @@
+import logging
 import os
-from PyPDF2 import PdfReader
-import PyPDF2
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import TokenAuthentication, SessionAuthentication
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains.question_answering import load_qa_chain
-from langchain.prompts import PromptTemplate
+from rest_framework.exceptions import AuthenticationFailed
 from django.conf import settings
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
@@ -20,130 +14,51 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from .models import Document, DocumentChunk, QueryHistory, Student
 from .serializers import DocumentSerializer, QueryHistorySerializer, StudentRegistrationSerializer, StudentSerializer
+from .embeddings import embed_documents, embed_query
+from . import admission, answer_cache, embeddings, health, ingestion, metrics, pagination
+from .context import assemble_context
+from .rerank import rerank
+from .admission import AdmissionRejected
+from .health import CircuitOpenError
+from .pagination import InvalidPageRequest
+from .ingestion import _sanitize_text, get_text_chunks
 from django.db import DatabaseError
+from django.db.models.functions import Length, Substr
 from django.core.exceptions import ObjectDoesNotExist
-import requests
+from django.http import HttpResponse, StreamingHttpResponse
+import json
 import tempfile
 import traceback
-# Check internet connection
-def check_internet_connection():
-    try:
-        requests.get("https://www.google.com", timeout=5)
-        return True
-    except:
-        return False
-
-# --- Unicode sanitization helper ---
-def _sanitize_text(value):
-    """
-    Remove surrogate code points and replace invalid sequences so the text
-    is safe for UTF-8 encoding, DB storage, and JSON serialization.
-    """
-    if value is None:
-        return ""
-    if not isinstance(value, str):
-        try:
-            value = str(value)
-        except Exception:
-            return ""
-    # Replace isolated surrogates and ensure valid UTF-8
-    # Encode with surrogatepass then decode ignoring invalids to drop any leftovers
-    try:
-        safe = value.encode('utf-8', 'surrogatepass').decode('utf-8', 'ignore')
-    except Exception:
-        # Fallback path if above fails for some reason
-        safe = value.encode('utf-8', 'ignore').decode('utf-8', 'ignore')
-    # Also normalize whitespace a bit
-    return safe.replace('\r\n', '\n').replace('\r', '\n')
-
-# Extract text from PDF - FIXED to handle Django FileField
+from contextlib import contextmanager
 
-# If you want to process the file directly without saving to database first
-# utils.py
-import PyPDF2
-import os
+# langchain, the Gemini client and the vector store (faiss) are imported
+# inside the functions that use them, so loading the URLconf - and with
+# it every manage.py command and the student/profile endpoints - does
+# not pull in the ML stack. It loads on the first RAG request instead.
 
-def get_pdf_text(file_path):
+logger = logging.getLogger(__name__)
+# Create vector store
+def get_vector_store(text_chunks):
     """
-    Extract text from a PDF file given its path
+    Build an in-memory index over the given texts without persisting it.
+    Document ingestion uses vector_store.add_chunks() instead.
     """
-    try:
-        print(f"📄 Reading PDF from path: {file_path}")
-        
-        # Check if file exists
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"PDF file not found at path: {file_path}")
-        
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                extracted = page.extract_text() or ""
-                # Sanitize page text to avoid surrogate errors
-                extracted = _sanitize_text(extracted)
-                text += extracted
-                
-                # Add page separator for better readability
-                if page_num < len(pdf_reader.pages) - 1:
-                    text += "\n\n--- Page Break ---\n\n"
-        
-        text = _sanitize_text(text)
-        print(f"✅ Successfully extracted {len(text)} characters from PDF")
-        return text
-        
-    except FileNotFoundError as e:
-        print(f"❌ File not found error: {e}")
-        raise e
-    except Exception as e:
-        print(f"❌ Error reading PDF: {e}")
-        raise Exception(f"Error reading PDF: {str(e)}")
+    from .vector_store import ChunkIndex
 
-# Then in your view:
-# raw_text = get_pdf_text_from_file(file)  # Use this if you don't want to save first
-
-# Split text into chunks
-def get_text_chunks(text):
-    text = _sanitize_text(text)
-    if not text.strip():
-        raise Exception("No text extracted from PDF.")
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=10000, 
-        chunk_overlap=1000
-    )
-    chunks = text_splitter.split_text(text)
-    # Sanitize each chunk defensively
-    return [_sanitize_text(c) for c in chunks if isinstance(c, str)]
-
-# Create vector store
-def get_vector_store(text_chunks):
     if not text_chunks:
         raise Exception("No text chunks to process.")
     
     try:
         # Ensure all texts are sanitized to avoid any embedding/serialize issues
         safe_texts = [_sanitize_text(t) for t in text_chunks]
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
-        
-        vector_store = FAISS.from_texts(safe_texts, embedding=embeddings)
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.join(settings.BASE_DIR, "faiss_index"), exist_ok=True)
-        vector_store.save_local(os.path.join(settings.BASE_DIR, "faiss_index"))
-        return True
+        vectors = embed_documents(safe_texts)
+        chunk_index = ChunkIndex.create(len(vectors[0]))
+        chunk_index.add(range(len(vectors)), vectors)
+        return chunk_index
     except Exception as e:
         raise Exception(f"Error creating vector store: {str(e)}")
 
-# Get conversational chain
-def get_conversational_chain():
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise Exception("Google API key not found.")    
-    prompt_template = """
+QA_PROMPT_TEMPLATE = """
     Answer the question as detailed as possible from the provided context, make sure to provide all the details, if the answer is not in
     provided context just say, "answer is not available in the context", don't provide the wrong answer\n\n
     Context:\n {context}?\n
@@ -152,49 +67,212 @@ def get_conversational_chain():
     Answer:
     """
 
-    model = ChatGoogleGenerativeAI(
+def get_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise Exception("Google API key not found.")    
+    return ChatGoogleGenerativeAI(
         model="gemini-1.5-flash",
         temperature=0.3,
         google_api_key=api_key
     )
 
-    prompt = PromptTemplate(
-        template=prompt_template, 
+def get_qa_prompt():
+    from langchain.prompts import PromptTemplate
+
+    return PromptTemplate(
+        template=QA_PROMPT_TEMPLATE, 
         input_variables=["context", "question"]
     )
-    chain = load_qa_chain(model, chain_type="stuff", prompt=prompt)
+
+# Get conversational chain
+def get_conversational_chain(llm=None):
+    from langchain.chains.question_answering import load_qa_chain
+
+    chain = load_qa_chain(llm or get_llm(), chain_type="stuff", prompt=get_qa_prompt())
     return chain
 
-# Process user question
-def process_user_question(user_question):
+def retrieve_context(user, user_question):
+    """
+    Answer from the cache if possible, otherwise retrieve the chunks for
+    the question. Returns (cached_answer, docs, index_version, question_vector);
+    docs is None on a cache hit.
+    """
+    from . import vector_store
+
+    # Repeated or near-identical questions against an unchanged index
+    # are answered from the cache without retrieval or an LLM call
+    version = vector_store.index_version(user)
+    answer = answer_cache.get_answer(user, version, user_question)
+    if answer is not None:
+        metrics.answer_cache_lookups.inc(result='hit')
+        return answer, None, version, None
+    
+    question_vector = embed_query(user_question)
+    answer = answer_cache.get_similar_answer(user, version, question_vector)
+    if answer is not None:
+        metrics.answer_cache_lookups.inc(result='near_hit')
+        return answer, None, version, question_vector
+    if settings.RAG_ANSWER_CACHE_ENABLED:
+        metrics.answer_cache_lookups.inc(result='miss')
+    
+    # With reranking on, over-fetch and let the reranker pick the best few
+    candidates = settings.RAG_RERANK_CANDIDATES if settings.RAG_RERANK else None
+    with metrics.span('retrieve'):
+        docs = vector_store.similarity_search(user, user_question, k=candidates, query_vector=question_vector)
+    if settings.RAG_RERANK:
+        with metrics.span('rerank'):
+            docs = rerank(user_question, docs)
+    # Bound the prompt: drop weak and repeated text, then fit the budget
+    with metrics.span('assemble_context'):
+        docs, _ = assemble_context(user_question, docs, QA_PROMPT_TEMPLATE)
+    return None, docs, version, question_vector
+
+def _llm_outcome(error):
+    """Label for rag_llm_calls_total from the exception an LLM call raised."""
+    if error is None:
+        return 'ok'
+    if isinstance(error, AdmissionRejected):
+        return 'rejected'
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    return 'error'
+
+@contextmanager
+def question_errors():
+    """Report unexpected failures answering a question in one message; overload errors pass through."""
     try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
-        
-        faiss_index_path = os.path.join(settings.BASE_DIR, "faiss_index")
-        if not os.path.exists(faiss_index_path):
-            raise Exception("Please process PDF documents first before asking questions.")
-            
-        new_db = FAISS.load_local(
-            faiss_index_path, 
-            embeddings, 
-            allow_dangerous_deserialization=True
-        )
+        yield
+    except (CircuitOpenError, AdmissionRejected):
+        raise
+    except Exception as e:
+        raise Exception(f"Error processing your question: {str(e)}")
+
+@contextmanager
+def counted_llm_call():
+    """Count the LLM call inside the block in rag_llm_calls_total by outcome."""
+    try:
+        yield
+    except Exception as e:
+        metrics.llm_calls.inc(outcome=_llm_outcome(e))
+        raise
+    metrics.llm_calls.inc(outcome='ok')
+
+def prepare_llm_call(docs, user_question, llm=None):
+    """
+    The QA chain and its inputs; fails fast, without a network round-trip,
+    if Gemini is known to be down. A caller-supplied llm (the benchmark's
+    fake) replaces Gemini, so Gemini's health is not consulted.
+    """
+    if llm is None:
+        health.check_llm_available()
+    return get_conversational_chain(llm), {"input_documents": docs, "question": user_question}
+
+# Process user question
+def process_user_question(user, user_question, llm=None, limiter=None):
+    """Answer a question; llm and limiter default to Gemini and the shared LLM limiter."""
+    limiter = limiter or admission.llm_limiter
+    with question_errors():
+        answer, docs, version, question_vector = retrieve_context(user, user_question)
+        if answer is not None:
+            return answer
         
-        docs = new_db.similarity_search(user_question)
-        chain = get_conversational_chain()
+        with counted_llm_call():
+            chain, inputs = prepare_llm_call(docs, user_question, llm)
+            # Queue for one of a bounded number of concurrent LLM calls
+            with metrics.span('llm_wait'):
+                slot = limiter.acquire(user)
+            with slot, metrics.span('llm'):
+                response = health.llm_breaker.call(chain, inputs, return_only_outputs=True)
         
-        response = chain(
-            {"input_documents": docs, "question": user_question},
-            return_only_outputs=True
-        )
+        answer = response["output_text"]
+        answer_cache.store_answer(user, version, user_question, answer, question_vector)
+        return answer
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_user_question(user, user_question, llm=None, limiter=None):
+    """
+    Generator of Server-Sent Events for one question: a 'context' event
+    with the retrieved chunks, 'token' events as the LLM produces text,
+    then 'done' with the full answer (or 'error'). Retrieval runs before
+    the first event so failures there can still become a normal error
+    response; the answer is saved to QueryHistory once generation ends.
+    llm and limiter are as for process_user_question.
+    """
+    limiter = limiter or admission.llm_limiter
+    answer, docs, version, question_vector = retrieve_context(user, user_question)
+    slot = None
+    if answer is None:
+        try:
+            if llm is None:
+                health.check_llm_available()
+            with metrics.span('llm_wait'):
+                slot = limiter.acquire(user)
+        except Exception as e:
+            metrics.llm_calls.inc(outcome=_llm_outcome(e))
+            raise
+    
+    def events():
+        if answer is not None:
+            yield _sse("context", {"cached": True, "chunks": []})
+            yield _sse("token", {"text": answer})
+            full_answer = answer
+        else:
+            yield _sse("context", {
+                "cached": False,
+                "chunks": [doc.metadata for doc in docs],
+            })
+            prompt = get_qa_prompt().format(
+                context="\n\n".join(doc.page_content for doc in docs),
+                question=user_question,
+            )
+            parts = []
+            try:
+                if not health.llm_breaker.allow():
+                    raise CircuitOpenError(health.llm_breaker.name, health.llm_breaker.retry_after())
+                for chunk in (llm or get_llm()).stream(prompt):
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield _sse("token", {"text": chunk.content})
+            except CircuitOpenError as e:
+                metrics.llm_calls.inc(outcome=_llm_outcome(e))
+                yield _sse("error", {"error": str(e), "retry_after": e.retry_after})
+                return
+            except Exception as e:
+                health.llm_breaker.record_failure()
+                metrics.llm_calls.inc(outcome=_llm_outcome(e))
+                logger.exception("Error streaming answer")
+                yield _sse("error", {"error": f"Error processing your question: {str(e)}"})
+                return
+            except BaseException:
+                # The client went away mid-stream (GeneratorExit)
+                health.llm_breaker.release_trial()
+                raise
+            health.llm_breaker.record_success()
+            metrics.llm_calls.inc(outcome='ok')
+            full_answer = "".join(parts)
+            answer_cache.store_answer(user, version, user_question, full_answer, question_vector)
         
-        return response["output_text"]
-    except Exception as e:
-        raise Exception(f"Error processing your question: {str(e)}")
-    # views.py
+        QueryHistory.objects.create(user=user, question=user_question, answer=full_answer)
+        yield _sse("done", {"question": user_question, "answer": full_answer})
+    
+    # The LLM slot is held until the stream ends or the client goes away
+    return slot.wrap(events()) if slot is not None else events()
+
+def validate_upload(file):
+    """Return an error message for an unacceptable upload, or None."""
+    if file is None:
+        return "No file provided."
+    if not file.name.endswith('.pdf'):
+        return "Only PDF files are allowed."
+    # Check file size
+    if file.size > 10 * 1024 * 1024:  # 10MB limit
+        return "File size too large. Maximum 10MB allowed."
+    return None
 
 # views.py
 @api_view(['POST'])
@@ -202,112 +280,57 @@ def process_user_question(user_question):
 @permission_classes([IsAuthenticated])
 def upload_document(request):
     try:
-        if not check_internet_connection():
-            return Response(
-                {"error": "No internet connection detected."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if 'file' not in request.FILES:
+        error = validate_upload(request.FILES.get('file'))
+        if error:
             return Response(
-                {"error": "No file provided."},
+                {"error": error},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         file = request.FILES['file']
-        if not file.name.endswith('.pdf'):
-            return Response(
-                {"error": "Only PDF files are allowed."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # Save the document and hand it to the ingestion queue; the client
+        # polls documents/<id>/status/ until processing finishes
+        document = Document(user=request.user, file=file)
+        document.save()
+        logger.info("Document saved: %s", document.file.name)
+        ingestion.enqueue(document)
         
-        # Check file size
-        if file.size > 10 * 1024 * 1024:  # 10MB limit
+        if document.status == Document.STATUS_FAILED:
             return Response(
-                {"error": "File size too large. Maximum 10MB allowed."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        document = None
-        try:
-            # Save document first to get the file path
-            document = Document(user=request.user, file=file)
-            document.save()
-            print(f"✅ Document saved: {document.file.name}")
-            print(f"📁 File path: {document.file.path}")
-            
-            # Process document - pass the actual file path, not the file object
-            print("📖 Extracting text from PDF...")
-            
-            # FIX: Use the saved file path instead of the file object
-            raw_text = get_pdf_text(document.file.path)  # Pass the file path
-            raw_text = _sanitize_text(raw_text)
-            print(f"✅ Text extracted: {len(raw_text)} characters")
-            
-            print("✂️ Splitting text into chunks...")
-            text_chunks = get_text_chunks(raw_text)
-            print(f"✅ Created {len(text_chunks)} text chunks")
-            
-            # Save chunks to database
-            print("💾 Saving chunks to database...")
-            for i, chunk in enumerate(text_chunks):
-                chunk = _sanitize_text(chunk)
-                DocumentChunk.objects.create(
-                    document=document,
-                    chunk_text=chunk,
-                    chunk_index=i
-                )
-            print("✅ Chunks saved to database")
-            
-            # Create vector store
-            print("🔧 Creating vector store...")
-            all_chunks = DocumentChunk.objects.filter(document__user=request.user)
-            all_texts = [chunk.chunk_text for chunk in all_chunks]
-            get_vector_store(all_texts)
-            print("✅ Vector store created")
-            
-            document.processed = True
-            document.save()
-            print("✅ Document marked as processed")
-            
-            serializer = DocumentSerializer(document)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        
-        except Exception as e:
-            print(f"❌ ERROR in upload_document: {str(e)}")
-            print("🔍 Full traceback:")
-            import traceback
-            traceback.print_exc()
-            
-            # Clean up the document if processing failed
-            if document and document.pk:
-                print("🧹 Cleaning up failed document...")
-                document.delete()
-            
-            return Response(
-                {"error": f"Failed to process PDF: {str(e)}"},
+                {"error": document.error},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        
+        data = DocumentSerializer(document).data
+        data['job_id'] = document.id
+        if document.status == Document.STATUS_COMPLETED:
+            return Response(data, status=status.HTTP_201_CREATED)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
             
-    except Exception as e:
-        print(f"❌ UNHANDLED EXCEPTION in upload_document: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Unhandled exception in upload_document")
         return Response(
             {"error": "Internal server error"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
     
+def overloaded_response(error, response_class=Response):
+    """
+    503 for an open circuit breaker, 429 for a full LLM queue, each with
+    a Retry-After header. Shared with the async views (JsonResponse).
+    """
+    if isinstance(error, CircuitOpenError):
+        response = response_class({"error": str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = str(int(error.retry_after) + 1)
+    else:
+        response = response_class({"error": str(error)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = str(error.retry_after)
+    return response
+
     #ask question
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def ask_question(request):
-    if not check_internet_connection():
-        return Response(
-            {"error": "No internet connection detected."},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
     question = request.data.get('question', '')
     if not question:
         return Response(
@@ -323,7 +346,7 @@ def ask_question(request):
         )
     
     try:
-        answer = process_user_question(question)
+        answer = process_user_question(request.user, question)
         
         # Save query to history
         query_history = QueryHistory.objects.create(
@@ -337,47 +360,156 @@ def ask_question(request):
             "answer": answer
         }, status=status.HTTP_200_OK)
     
+    except (CircuitOpenError, AdmissionRejected) as e:
+        return overloaded_response(e)
     except Exception as e:
-        print(f"Error answering question: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error answering question")
         
         return Response(
             {"error": str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def ask_question_stream(request):
+    """
+    Streaming variant of ask_question using Server-Sent Events, so the
+    client sees the answer as it is generated.
+    """
+    question = request.data.get('question', '')
+    if not question:
+        return Response(
+            {"error": "No question provided."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if not Document.objects.filter(user=request.user, processed=True).exists():
+        return Response(
+            {"error": "Please process PDF documents first before asking questions."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        events = stream_user_question(request.user, question)
+    except (CircuitOpenError, AdmissionRejected) as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.exception("Error answering question")
+        return Response(
+            {"error": f"Error processing your question: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_documents(request):
+    """
+    All of the user's documents, or with ?limit= / ?cursor= one page of
+    them, newest first, as {"results": [...], "next_cursor": ...}.
+    ?fields=id,status limits the columns returned.
+    """
     documents = Document.objects.filter(user=request.user)
-    serializer = DocumentSerializer(documents, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    if not pagination.is_paginated(request):
+        serializer = DocumentSerializer(documents, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    
+    try:
+        fields = pagination.requested_fields(request, DocumentSerializer.Meta.fields)
+        if fields:
+            documents = documents.only('id', 'uploaded_at', *fields)
+        rows, next_cursor = pagination.keyset_page(documents, request, 'uploaded_at')
+    except InvalidPageRequest as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        "results": DocumentSerializer(rows, many=True, fields=fields).data,
+        "next_cursor": next_cursor,
+    }, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_query_history(request):
-    queries = QueryHistory.objects.filter(user=request.user).order_by('-created_at')
-    serializer = QueryHistorySerializer(queries, many=True)
+    """
+    The user's full history, or with ?limit= / ?cursor= one page of it,
+    newest first. ?fields= limits the columns and ?answer_chars=N returns
+    only the first N characters of each answer (read in the database).
+    """
+    queries = QueryHistory.objects.filter(user=request.user)
+    if not pagination.is_paginated(request):
+        serializer = QueryHistorySerializer(queries.order_by('-created_at'), many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    
+    try:
+        fields = pagination.requested_fields(request, QueryHistorySerializer.Meta.fields)
+        if fields:
+            queries = queries.only('id', 'created_at', *fields)
+        answer_chars = request.query_params.get('answer_chars')
+        truncate = answer_chars is not None and (fields is None or 'answer' in fields)
+        if truncate:
+            if not answer_chars.isdigit() or int(answer_chars) < 1:
+                raise InvalidPageRequest("answer_chars must be a positive integer.")
+            queries = queries.defer('answer').annotate(
+                answer_excerpt=Substr('answer', 1, int(answer_chars)),
+                answer_length=Length('answer'),
+            )
+        rows, next_cursor = pagination.keyset_page(queries, request, 'created_at')
+    except InvalidPageRequest as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if truncate:
+        for row in rows:
+            row.answer = row.answer_excerpt
+    results = QueryHistorySerializer(rows, many=True, fields=fields).data
+    if truncate:
+        for row, item in zip(rows, results):
+            item['answer_truncated'] = row.answer_length > len(row.answer_excerpt)
+    return Response({"results": results, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def document_status(request, document_id):
+    """
+    Ingestion status for one uploaded document. Pass ?wait=<seconds> to
+    long-poll until the job finishes or its progress changes; the wait
+    holds a worker, so clients served by WSGI should short-poll instead.
+    """
+    try:
+        document = Document.objects.get(id=document_id, user=request.user)
+    except Document.DoesNotExist:
+        return Response(
+            {"error": "Document not found."},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    try:
+        wait = float(request.query_params.get('wait', 0))
+    except ValueError:
+        wait = 0
+    wait = min(max(wait, 0), settings.RAG_INGESTION_LONG_POLL_MAX)
+    if wait:
+        ingestion.wait_for_document(document, wait)
+    
+    serializer = DocumentSerializer(document)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def delete_document(request, document_id):
+    from . import vector_store
+
     try:
         document = Document.objects.get(id=document_id, user=request.user)
+        chunk_ids = list(document.documentchunk_set.values_list('pk', flat=True))
         document.delete()
         
-        # Recreate vector store with remaining documents
-        all_chunks = DocumentChunk.objects.filter(document__user=request.user)
-        if all_chunks.exists():
-            all_texts = [chunk.chunk_text for chunk in all_chunks]
-            get_vector_store(all_texts)
-        else:
-            # Remove FAISS index if no documents left
-            faiss_index_path = os.path.join(settings.BASE_DIR, "faiss_index")
-            if os.path.exists(faiss_index_path):
-                import shutil
-                shutil.rmtree(faiss_index_path)
+        # Drop exactly this document's chunks from the vector store
+        vector_store.remove_chunks(request.user, chunk_ids)
         
         return Response(status=status.HTTP_204_NO_CONTENT)
     
@@ -392,15 +524,48 @@ def delete_document(request, document_id):
 @permission_classes([IsAuthenticated])
 def debug_status(request):
     """Debug endpoint to check system status"""
+    from . import vector_store
+
     status_info = {
         'has_google_api_key': os.getenv("GOOGLE_API_KEY") is not None,
-        'faiss_index_exists': os.path.exists(os.path.join(settings.BASE_DIR, "faiss_index")),
+        'faiss_index_exists': vector_store.index_exists(request.user),
+        'index_cache': vector_store.index_cache.stats(),
+        'query_embedding': embeddings.get_query_batcher().stats(),
+        'dependencies': health.status(),
+        'llm_admission': admission.llm_limiter.snapshot(),
         'processed_documents': Document.objects.filter(user=request.user, processed=True).count(),
         'total_documents': Document.objects.filter(user=request.user).count(),
         'document_chunks': DocumentChunk.objects.filter(document__user=request.user).count(),
     }
     return Response(status_info)
 
+def _metrics_user(request):
+    """Staff session or JWT user allowed to read the metrics, else None."""
+    user = request.user if request.user.is_authenticated else None
+    if user is None:
+        try:
+            authenticated = JWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            authenticated = None
+        user = authenticated[0] if authenticated else None
+    return user if user is not None and user.is_staff else None
+
+def prometheus_metrics(request):
+    """
+    Pipeline metrics in the Prometheus text format. Scrapers send
+    RAG_METRICS_TOKEN as a bearer token; staff users may read them with
+    their session or JWT. RAG_METRICS_PUBLIC=True drops the check.
+    """
+    token = settings.RAG_METRICS_TOKEN
+    allowed = (
+        settings.RAG_METRICS_PUBLIC
+        or (token and request.headers.get('Authorization') == f"Bearer {token}")
+        or _metrics_user(request) is not None
+    )
+    if not allowed:
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # Add test endpoint for PDF processing
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -411,11 +576,11 @@ def test_pdf_processing(request):
         test_text = "This is a test document about artificial intelligence. AI is transforming various industries including healthcare, finance, and education. Machine learning algorithms can now recognize patterns and make predictions with remarkable accuracy."
         
         chunks = get_text_chunks(test_text)
-        print(f"Test chunks created: {len(chunks)}")
+        logger.debug("Test chunks created: %d", len(chunks))
         
         # Test vector store
         get_vector_store(chunks)
-        print("Test vector store created")
+        logger.debug("Test vector store created")
         
         return Response({
             "success": True,
@@ -425,7 +590,7 @@ def test_pdf_processing(request):
         
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"PDF processing test failed: {error_trace}")
+        logger.error("PDF processing test failed: %s", error_trace)
         
         return Response({
             "success": False,
@@ -516,11 +681,35 @@ def update_student_profile(request):
 def list_students(request):
     """
     List all students (admin only - you might want to add admin permission check)
+    Filter with ?department= and ?year_of_study=; send ?limit= / ?cursor=
+    for keyset-paginated pages of {"results": [...], "next_cursor": ...}.
     """
     try:
-        students = Student.objects.filter(is_active=True)
-        serializer = StudentSerializer(students, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # The serializer reads username and email through the user FK
+        students = Student.objects.filter(is_active=True).select_related('user')
+        department = request.query_params.get('department')
+        if department:
+            students = students.filter(department=department)
+        year_of_study = request.query_params.get('year_of_study')
+        if year_of_study:
+            if not year_of_study.isdigit():
+                return Response({
+                    "error": "year_of_study must be an integer."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            students = students.filter(year_of_study=int(year_of_study))
+        
+        if not pagination.is_paginated(request):
+            serializer = StudentSerializer(students, many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        
+        try:
+            rows, next_cursor = pagination.keyset_page(students, request, 'registration_date')
+        except InvalidPageRequest as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "results": StudentSerializer(rows, many=True).data,
+            "next_cursor": next_cursor,
+        }, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({
             "error": "Failed to retrieve students",
@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rag_app.metrics.server_timing_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -130,4 +131,177 @@ SIMPLE_JWT = {
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
 # FAISS index path
-FAISS_INDEX_PATH = BASE_DIR / 'faiss_index'
\ No newline at end of file
+FAISS_INDEX_PATH = BASE_DIR / 'faiss_index'
+# Embedding model (loaded once per worker process)
+RAG_EMBEDDING_MODEL = os.getenv('RAG_EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+RAG_EMBEDDING_DEVICE = os.getenv('RAG_EMBEDDING_DEVICE', 'cpu')
+RAG_EMBEDDING_BATCH_SIZE = int(os.getenv('RAG_EMBEDDING_BATCH_SIZE', '32'))
+# 0 keeps the torch default (one thread per core)
+RAG_EMBEDDING_THREADS = int(os.getenv('RAG_EMBEDDING_THREADS', '0'))
+# Load the model in AppConfig.ready() instead of on the first RAG request
+RAG_EMBEDDING_WARMUP = os.getenv('RAG_EMBEDDING_WARMUP', 'False') == 'True'
+# Compact the FAISS index once this fraction of its vectors are deleted
+RAG_INDEX_TOMBSTONE_RATIO = float(os.getenv('RAG_INDEX_TOMBSTONE_RATIO', '0.2'))
+# Memory budget for loaded index shards kept resident in each worker
+RAG_INDEX_CACHE_BYTES = int(os.getenv('RAG_INDEX_CACHE_BYTES', str(512 * 1024 * 1024)))
+
+# Document ingestion queue: 'thread' runs jobs in a local worker pool,
+# 'worker' leaves them for `manage.py run_ingestion_worker`, 'sync' runs
+# them inside the upload request
+RAG_INGESTION_MODE = os.getenv('RAG_INGESTION_MODE', 'thread')
+RAG_INGESTION_WORKERS = int(os.getenv('RAG_INGESTION_WORKERS', '2'))
+RAG_INGESTION_POLL_SECONDS = float(os.getenv('RAG_INGESTION_POLL_SECONDS', '2'))
+# Jobs stuck in 'processing' this long are assumed dead and requeued
+RAG_INGESTION_STALE_SECONDS = int(os.getenv('RAG_INGESTION_STALE_SECONDS', '900'))
+RAG_INGESTION_LONG_POLL_MAX = float(os.getenv('RAG_INGESTION_LONG_POLL_MAX', '30'))
+RAG_INGESTION_LONG_POLL_INTERVAL = 0.5
+
+# PDF text extraction: files with at least RAG_PDF_PARALLEL_MIN_PAGES pages
+# are split into page ranges across this many worker processes
+RAG_PDF_WORKERS = int(os.getenv('RAG_PDF_WORKERS', str(min(4, os.cpu_count() or 1))))
+RAG_PDF_PARALLEL_MIN_PAGES = int(os.getenv('RAG_PDF_PARALLEL_MIN_PAGES', '40'))
+
+# Rows per INSERT / embedding batch when storing and indexing chunks
+RAG_CHUNK_BATCH_SIZE = int(os.getenv('RAG_CHUNK_BATCH_SIZE', '500'))
+# Chunk size in embedding-model tokens (capped at the model's window, 254
+# usable tokens for all-MiniLM-L6-v2) and the overlap between consecutive
+# chunks of a section
+RAG_CHUNK_TOKENS = int(os.getenv('RAG_CHUNK_TOKENS', '200'))
+RAG_CHUNK_OVERLAP_TOKENS = int(os.getenv('RAG_CHUNK_OVERLAP_TOKENS', '30'))
+# Chunk embeddings are stored in the database in this dtype ('float16'
+# halves the space at a negligible recall cost); changing the model or
+# its version makes stored vectors stale so they are re-embedded
+RAG_EMBEDDING_STORAGE_DTYPE = os.getenv('RAG_EMBEDDING_STORAGE_DTYPE', 'float16')
+RAG_EMBEDDING_MODEL_VERSION = os.getenv('RAG_EMBEDDING_MODEL_VERSION', '')
+
+RAG_ANSWER_CACHE_TTL = int(os.getenv('RAG_ANSWER_CACHE_TTL', '86400'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Answers to repeated questions; point this at Redis/Memcached to share
+    # it between worker processes
+    'rag_answers': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'rag-answers',
+        'TIMEOUT': RAG_ANSWER_CACHE_TTL,
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('RAG_ANSWER_CACHE_MAX_ENTRIES', '5000'))},
+    },
+}
+
+# Answer cache: exact matches on the normalised question, plus, opt-in,
+# near duplicates whose question embeddings reach this cosine similarity
+# (0, the default, disables near-duplicate matching)
+RAG_ANSWER_CACHE_ENABLED = os.getenv('RAG_ANSWER_CACHE_ENABLED', 'True') == 'True'
+RAG_ANSWER_CACHE_ALIAS = 'rag_answers'
+RAG_ANSWER_CACHE_SIMILARITY = float(os.getenv('RAG_ANSWER_CACHE_SIMILARITY', '0'))
+RAG_ANSWER_CACHE_NEIGHBOURS = int(os.getenv('RAG_ANSWER_CACHE_NEIGHBOURS', '200'))
+
+# LLM dependency health: the Gemini API is probed in the background at
+# most once per TTL, and the circuit opens after consecutive failures
+RAG_HEALTH_CHECK_ENABLED = os.getenv('RAG_HEALTH_CHECK_ENABLED', 'True') == 'True'
+RAG_HEALTH_CHECK_TTL = int(os.getenv('RAG_HEALTH_CHECK_TTL', '30'))
+RAG_HEALTH_CHECK_TIMEOUT = float(os.getenv('RAG_HEALTH_CHECK_TIMEOUT', '5'))
+RAG_LLM_BREAKER_FAILURES = int(os.getenv('RAG_LLM_BREAKER_FAILURES', '5'))
+RAG_LLM_BREAKER_RESET_SECONDS = int(os.getenv('RAG_LLM_BREAKER_RESET_SECONDS', '30'))
+
+# Vector index type per shard, chosen by vector count: exact flat search,
+# then HNSW, then IVF-PQ. nprobe/efSearch trade recall for latency; use
+# `manage.py index_recall_report` to pick them.
+RAG_INDEX_HNSW_MIN_VECTORS = int(os.getenv('RAG_INDEX_HNSW_MIN_VECTORS', '20000'))
+RAG_INDEX_IVFPQ_MIN_VECTORS = int(os.getenv('RAG_INDEX_IVFPQ_MIN_VECTORS', '500000'))
+RAG_INDEX_HNSW_M = int(os.getenv('RAG_INDEX_HNSW_M', '32'))
+RAG_INDEX_EF_SEARCH = int(os.getenv('RAG_INDEX_EF_SEARCH', '64'))
+RAG_INDEX_NPROBE = int(os.getenv('RAG_INDEX_NPROBE', '16'))
+RAG_INDEX_TRAIN_SAMPLE = int(os.getenv('RAG_INDEX_TRAIN_SAMPLE', '50000'))
+
+# Map shard indexes read-only for search instead of loading a private
+# copy, so worker processes share one page-cache copy of each shard
+RAG_INDEX_MMAP = os.getenv('RAG_INDEX_MMAP', 'True') == 'True'
+
+# Retrieval: chunks passed to the LLM per question. Hybrid search fuses
+# the top RAG_HYBRID_CANDIDATES vector and BM25 hits with reciprocal rank
+# fusion (RAG_RRF_K damps the weight of top ranks)
+RAG_RETRIEVAL_K = int(os.getenv('RAG_RETRIEVAL_K', '4'))
+RAG_HYBRID_SEARCH = os.getenv('RAG_HYBRID_SEARCH', 'True') == 'True'
+RAG_HYBRID_CANDIDATES = int(os.getenv('RAG_HYBRID_CANDIDATES', '20'))
+RAG_RRF_K = int(os.getenv('RAG_RRF_K', '60'))
+
+# Context assembly: retrieved chunks are fitted into RAG_CONTEXT_TOKENS
+# tokens per prompt. With RAG_CONTEXT_DISTANCE_RATIO set, vector-only hits
+# (no BM25 match) further than that many times the best match's L2
+# distance are dropped (0, the default, keeps all), repeated
+# sentences are sent once, and with RAG_CONTEXT_EXTRACT_SENTENCES only the
+# RAG_CONTEXT_SENTENCES_PER_CHUNK sentences closest to the question are kept
+RAG_CONTEXT_TOKENS = int(os.getenv('RAG_CONTEXT_TOKENS', '1500'))
+RAG_CONTEXT_DISTANCE_RATIO = float(os.getenv('RAG_CONTEXT_DISTANCE_RATIO', '0'))
+RAG_CONTEXT_EXTRACT_SENTENCES = os.getenv('RAG_CONTEXT_EXTRACT_SENTENCES', 'False') == 'True'
+RAG_CONTEXT_SENTENCES_PER_CHUNK = int(os.getenv('RAG_CONTEXT_SENTENCES_PER_CHUNK', '4'))
+
+# Optional reranking: '' (off), 'lexical' or 'cross-encoder'. Retrieval
+# fetches RAG_RERANK_CANDIDATES chunks, which are scored in batches of
+# RAG_RERANK_BATCH_SIZE until RAG_RERANK_TIMEOUT_MS has passed; the best
+# RAG_RETRIEVAL_K are kept. Scores are cached per (question, chunk).
+RAG_RERANK = os.getenv('RAG_RERANK', '')
+RAG_RERANK_MODEL = os.getenv('RAG_RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RAG_RERANK_CANDIDATES = int(os.getenv('RAG_RERANK_CANDIDATES', '20'))
+RAG_RERANK_BATCH_SIZE = int(os.getenv('RAG_RERANK_BATCH_SIZE', '8'))
+RAG_RERANK_TIMEOUT_MS = float(os.getenv('RAG_RERANK_TIMEOUT_MS', '150'))
+RAG_RERANK_CACHE_SIZE = int(os.getenv('RAG_RERANK_CACHE_SIZE', '10000'))
+
+# Query embedding micro-batching: concurrent questions are embedded in one
+# forward pass of up to RAG_QUERY_BATCH_SIZE, waiting at most
+# RAG_QUERY_BATCH_WAIT_MS for others to arrive (batch size 1 disables it)
+RAG_QUERY_BATCH_SIZE = int(os.getenv('RAG_QUERY_BATCH_SIZE', '32'))
+RAG_QUERY_BATCH_WAIT_MS = float(os.getenv('RAG_QUERY_BATCH_WAIT_MS', '5'))
+
+# Async (ASGI) endpoints: threads for embedding, FAISS search and other
+# blocking work, shared by every in-flight request in the process
+RAG_ASYNC_CPU_WORKERS = int(os.getenv('RAG_ASYNC_CPU_WORKERS', str(min(8, os.cpu_count() or 1))))
+
+# Admission control for LLM calls: at most RAG_LLM_MAX_CONCURRENT run at
+# once, RAG_LLM_MAX_QUEUE more wait up to RAG_LLM_QUEUE_TIMEOUT seconds
+# (served round-robin across users), and each user may have at most
+# RAG_LLM_PER_USER running or queued. The rest get 429 with Retry-After.
+RAG_LLM_MAX_CONCURRENT = int(os.getenv('RAG_LLM_MAX_CONCURRENT', '8'))
+RAG_LLM_MAX_QUEUE = int(os.getenv('RAG_LLM_MAX_QUEUE', '32'))
+RAG_LLM_QUEUE_TIMEOUT = float(os.getenv('RAG_LLM_QUEUE_TIMEOUT', '10'))
+RAG_LLM_PER_USER = int(os.getenv('RAG_LLM_PER_USER', '2'))
+
+# Keyset pagination of history and document lists (?limit=, ?cursor=)
+RAG_PAGE_SIZE = int(os.getenv('RAG_PAGE_SIZE', '50'))
+RAG_MAX_PAGE_SIZE = int(os.getenv('RAG_MAX_PAGE_SIZE', '200'))
+
+# Observability: per-stage timings are always recorded for the metrics/
+# endpoint (Prometheus text format). It answers scrapers that send
+# RAG_METRICS_TOKEN as a bearer token and staff users; set
+# RAG_METRICS_PUBLIC=True to serve it to anyone. RAG_SERVER_TIMING also
+# reports the timings to the client in a Server-Timing response header.
+RAG_SERVER_TIMING = os.getenv('RAG_SERVER_TIMING', 'False') == 'True'
+RAG_METRICS_TOKEN = os.getenv('RAG_METRICS_TOKEN', '')
+RAG_METRICS_PUBLIC = os.getenv('RAG_METRICS_PUBLIC', 'False') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'verbose',
+        },
+    },
+    'loggers': {
+        'rag_app': {
+            'handlers': ['console'],
+            'level': os.getenv('RAG_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}